@@ -0,0 +1,64 @@
+"""
+Run a JSONL file of PredictionRequest items ({"id": ..., "query": ...})
+through the /api/request pipeline without going over HTTP.
+
+Usage:
+    python batch_runner.py questions.jsonl --output answers.jsonl --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import List
+
+from schemas.request import PredictionRequest
+from src.config import get_settings
+from src.services.batch_service import run_batch
+from src.services.google_mistral_service import GoogleMistralService
+
+
+def read_items(path: str) -> List[PredictionRequest]:
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [
+            PredictionRequest.model_validate_json(line)
+            for line in stream
+            if line.strip()
+        ]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    items = read_items(args.input)
+    service = GoogleMistralService()
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    start_time = time.time()
+    failed = 0
+    try:
+        async for result in run_batch(service, items, args.concurrency):
+            failed += "error" in result
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"Processed {len(items)} requests ({failed} failed) in {time.time() - start_time:.1f}s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of ITMO questions")
+    parser.add_argument("input", help="JSONL file with PredictionRequest items, or - for stdin")
+    parser.add_argument("--output", "-o", default="-", help="Where to write JSONL results (default: stdout)")
+    parser.add_argument(
+        "--concurrency", "-c", type=int, default=get_settings().BATCH_CONCURRENCY,
+        help="Maximum number of pipelines running at once",
+    )
+    asyncio.run(main(parser.parse_args()))
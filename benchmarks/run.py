@@ -0,0 +1,307 @@
+"""
+Offline replay benchmark for main.py.
+
+Starts the upstream stand-ins (benchmarks/stubs.py) and the app under
+gunicorn, replays queries at a target rate against each endpoint and reports
+latency percentiles, throughput, per-stage timings (from the Server-Timing
+header) and worker RSS. Results can be stored as a baseline and compared
+against it to catch regressions.
+
+Usage:
+    python -m benchmarks.run --rps 5 --duration 30 --replay questions.jsonl \
+        --baseline benchmarks/baselines/default.json
+    python -m benchmarks.run --rps 5 --duration 30 --save-baseline benchmarks/baselines/default.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYNTHETIC_QUESTIONS = [
+    "В каком году был основан Университет ИТМО?\n1. 1900\n2. 1918\n3. 1930\n4. 1945",
+    "Сколько студентов учится в Университете ИТМО?",
+    "Which city is the main campus of ITMO University located in?\n1. Moscow\n2. Saint Petersburg\n3. Kazan",
+    "Когда начинается приём документов в магистратуру ИТМО?",
+    "What is ITMO University's position in the QS World University Rankings?",
+]
+
+# Metrics compared against the baseline: name -> True if higher is worse
+COMPARED_METRICS = {"p50_ms": True, "p95_ms": True, "p99_ms": True, "throughput_rps": False, "max_worker_rss_mb": True}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def worker_pids(master_pid: int) -> List[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, fields after it are fixed
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def load_queries(path: Optional[str]) -> List[str]:
+    if not path:
+        return SYNTHETIC_QUESTIONS
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+
+async def wait_ready(url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout:.0f}s")
+
+
+async def sample_rss(master_pid: int, samples: Dict[int, float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        for pid in worker_pids(master_pid):
+            value = rss_mb(pid)
+            if value is not None:
+                samples[pid] = max(samples.get(pid, 0.0), value)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(
+    base_url: str, endpoint: str, queries: List[str], rps: float, duration: float, synthetic: bool
+) -> Dict:
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    statuses: Dict[int, int] = {}
+    total = max(1, int(rps * duration))
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+        async def one(i: int) -> None:
+            query = queries[i % len(queries)]
+            if synthetic:
+                # Make synthetic queries unique so caches do not hide the pipeline cost
+                query = f"{query}\n(#{random.randrange(10 ** 9)})"
+            start_time = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json={"id": i, "query": query})
+                status = response.status_code
+                for name, value in parse_server_timing(response.headers.get("server-timing", "")).items():
+                    stages.setdefault(name, []).append(value)
+            except httpx.HTTPError:
+                status = 0
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        # Open-loop load: requests are started on schedule regardless of responses
+        start_time = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            delay = start_time + i / rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one(i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start_time
+
+    return {
+        "requests": total,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "throughput_rps": round(statuses.get(200, 0) / elapsed, 3),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "stages_ms": {
+            name: {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for name, values in sorted(stages.items())
+        },
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{endpoint} {metric}: {old:.1f} -> {new:.1f} ({change:+.0%})")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    workdir = tempfile.mkdtemp(prefix="itmo-bench-")
+
+    env = {
+        **os.environ,
+        "MISTRAL_API_KEY": "bench", "GOOGLE_API_KEY": "bench", "GOOGLE_CSE_ID": "bench",
+        "MISTRAL_SERVER_URL": stub_url,
+        "GOOGLE_API_ENDPOINT": stub_url + "/",
+        "SEARCH_CACHE_PATH": os.path.join(workdir, "search_cache.db"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache.db"),
+        "PAGE_CACHE_PATH": os.path.join(workdir, "page_cache.db"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+        "AGENT_MODE": args.agent_mode,
+    }
+    if not args.with_caches:
+        env.update({
+            "SEARCH_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "REQUEST_COALESCING_ENABLED": "false",
+        })
+    os.makedirs(os.path.join(REPO_ROOT, "logs"), exist_ok=True)
+
+    stub_cmd = [sys.executable, "-m", "benchmarks.stubs", "--port", str(stub_port)]
+    if args.stub_config:
+        stub_cmd += ["--config", args.stub_config]
+    app_cmd = [
+        sys.executable, "-m", "gunicorn", "main:app",
+        "-c", "gunicorn.conf.py",
+        "--workers", str(args.workers),
+        "--worker-class", "uvicorn.workers.UvicornWorker",
+        "--bind", f"127.0.0.1:{app_port}",
+    ]
+
+    stubs = subprocess.Popen(stub_cmd, cwd=REPO_ROOT, env=env)
+    app = subprocess.Popen(app_cmd, cwd=REPO_ROOT, env=env)
+    rss: Dict[int, float] = {}
+    stop = asyncio.Event()
+    try:
+        await wait_ready(f"{stub_url}/stats")
+        await wait_ready(f"{app_url}/docs")
+        sampler = asyncio.ensure_future(sample_rss(app.pid, rss, stop))
+
+        queries = load_queries(args.replay)
+        results = {
+            "config": {
+                "rps": args.rps, "duration": args.duration, "workers": args.workers,
+                "replay": args.replay, "with_caches": args.with_caches,
+            },
+            "endpoints": {},
+        }
+        for endpoint in args.endpoint:
+            print(f"Benchmarking {endpoint} at {args.rps} rps for {args.duration}s...", file=sys.stderr)
+            results["endpoints"][endpoint] = await run_load(
+                app_url, endpoint, queries, args.rps, args.duration, synthetic=args.replay is None
+            )
+
+        stop.set()
+        await sampler
+        worker_rss = sorted(rss.values())
+        for endpoint_results in results["endpoints"].values():
+            endpoint_results["max_worker_rss_mb"] = round(max(worker_rss), 1) if worker_rss else None
+        results["worker_rss_mb"] = [round(value, 1) for value in worker_rss]
+    finally:
+        app.terminate()
+        stubs.terminate()
+        app.wait(timeout=30)
+        stubs.wait(timeout=30)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark main.py against local upstream stand-ins")
+    parser.add_argument(
+        "--endpoint", action="append",
+        help="Endpoint to benchmark, may be repeated (default: /api/request and /api/google-mistral)",
+    )
+    parser.add_argument("--rps", type=float, default=5.0, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per endpoint")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--replay", help="JSONL file with {\"query\": ...} items (default: synthetic load)")
+    parser.add_argument("--stub-config", help="JSON file overriding the stand-in latency/error/payload config")
+    parser.add_argument(
+        "--agent-mode", choices=["react", "planned"], default="react",
+        help="Agent behind /api/google-mistral (AGENT_MODE)",
+    )
+    parser.add_argument("--with-caches", action="store_true", help="Keep search/answer caches enabled")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Compare against this baseline and exit 1 on regressions")
+    parser.add_argument("--save-baseline", help="Store these results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative change before a regression")
+    args = parser.parse_args()
+    args.endpoint = args.endpoint or ["/api/request", "/api/google-mistral"]
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,147 @@
+"""
+Startup benchmark for main.py.
+
+Starts the app under gunicorn with and without --preload (GUNICORN_PRELOAD)
+and reports the time until every worker answers, the import time of main.py
+and the RSS and PSS of the master and each worker. PSS splits pages shared
+copy-on-write between the processes sharing them, so it shows what preloading
+saves where RSS does not.
+
+Usage:
+    python -m benchmarks.startup --workers 4 --runs 3 --output startup.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.run import REPO_ROOT, free_port, rss_mb, worker_pids
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def pss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def base_env(workdir: str) -> Dict[str, str]:
+    # Placeholder keys: nothing is called upstream while starting
+    return {
+        **os.environ,
+        "MISTRAL_API_KEY": "bench", "GOOGLE_API_KEY": "bench", "GOOGLE_CSE_ID": "bench",
+        "SEARCH_CACHE_PATH": os.path.join(workdir, "search_cache.db"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache.db"),
+        "PAGE_CACHE_PATH": os.path.join(workdir, "page_cache.db"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, "prometheus"),
+    }
+
+
+def import_seconds(env: Dict[str, str]) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=REPO_ROOT, env=env,
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+async def wait_workers(url: str, master_pid: int, workers: int, timeout: float = 120.0) -> float:
+    """Seconds until all workers are forked and the app answers."""
+    start_time = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if len(worker_pids(master_pid)) >= workers:
+                try:
+                    # One request per worker; the kernel spreads them over the listening workers
+                    await asyncio.gather(*(client.get(url) for _ in range(workers)))
+                    return time.perf_counter() - start_time
+                except httpx.TransportError:
+                    pass
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"{url} did not become ready in {timeout:.0f}s")
+
+
+async def measure(preload: bool, workers: int, settle: float) -> Dict:
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="itmo-startup-")
+    env = {**base_env(workdir), "GUNICORN_PRELOAD": "true" if preload else "false"}
+    os.makedirs(os.path.join(REPO_ROOT, "logs"), exist_ok=True)
+    app = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "main:app",
+            "-c", "gunicorn.conf.py",
+            "--workers", str(workers),
+            "--worker-class", "uvicorn.workers.UvicornWorker",
+            "--bind", f"127.0.0.1:{port}",
+        ],
+        cwd=REPO_ROOT, env=env,
+    )
+    try:
+        ready = await wait_workers(f"http://127.0.0.1:{port}/docs", app.pid, workers)
+        # Let the workers finish their startup work before reading memory
+        await asyncio.sleep(settle)
+        pids = worker_pids(app.pid)
+        return {
+            "ready_s": round(ready, 3),
+            "master_rss_mb": round(rss_mb(app.pid) or 0, 1),
+            "master_pss_mb": round(pss_mb(app.pid) or 0, 1),
+            "worker_rss_mb": sorted(round(rss_mb(pid) or 0, 1) for pid in pids),
+            "worker_pss_mb": sorted(round(pss_mb(pid) or 0, 1) for pid in pids),
+        }
+    finally:
+        app.terminate()
+        app.wait(timeout=30)
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    def mean(values: List[float]) -> float:
+        return round(sum(values) / len(values), 3)
+
+    return {
+        "ready_s": mean([run["ready_s"] for run in runs]),
+        "worker_rss_mb": mean([sum(run["worker_rss_mb"]) / len(run["worker_rss_mb"]) for run in runs]),
+        "worker_pss_mb": mean([sum(run["worker_pss_mb"]) / len(run["worker_pss_mb"]) for run in runs]),
+        "total_pss_mb": mean([run["master_pss_mb"] + sum(run["worker_pss_mb"]) for run in runs]),
+        "runs": runs,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    env = base_env(tempfile.mkdtemp(prefix="itmo-startup-"))
+    results = {
+        "config": {"workers": args.workers, "runs": args.runs},
+        "import_main_s": round(min(import_seconds(env) for _ in range(args.runs)), 3),
+    }
+    for preload in (False, True):
+        mode = "preload" if preload else "no_preload"
+        print(f"Starting {args.workers} workers ({mode}) {args.runs} times...", file=sys.stderr)
+        results[mode] = summarize([await measure(preload, args.workers, args.settle) for _ in range(args.runs)])
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure startup time and worker memory of main.py")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--runs", type=int, default=3, help="Starts per mode")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait before reading memory")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,198 @@
+"""
+Local stand-ins for the Google Custom Search and Mistral chat APIs, plus
+result pages served with ETag/Last-Modified for the page fetcher.
+
+Latency is drawn from a log-normal distribution per backend, a configurable
+share of calls fails, and the JSON payloads can be replaced by a canned file.
+
+Usage:
+    python -m benchmarks.stubs --port 9100 --config benchmarks/stub_config.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "google": {"median_ms": 250, "sigma": 0.4, "error_rate": 0.0, "error_status": 500},
+    "pages": {"median_ms": 80, "sigma": 0.5, "error_rate": 0.0, "error_status": 500},
+    # Point search result links at the stub's own /pages so no real site is fetched
+    "serve_pages": True,
+    "mistral": {"median_ms": 1500, "sigma": 0.5, "error_rate": 0.0, "error_status": 500},
+    # Delay between streamed chunks
+    "mistral_stream_chunk_ms": 30,
+    "payloads": {
+        "search_items": [
+            {
+                "title": f"ITMO University page {i}",
+                "link": f"https://itmo.ru/ru/page/{i}",
+                "snippet": "ITMO University was founded in 1900 in Saint Petersburg. "
+                           "Университет ИТМО основан в 1900 году в Санкт-Петербурге.",
+            }
+            for i in range(1, 6)
+        ],
+        "page_html": "<html><head><title>ITMO University</title></head><body><nav>Menu</nav>"
+                     "<p>ITMO University was founded in 1900 in Saint Petersburg as a vocational school.</p>"
+                     "<p>Университет ИТМО основан в 1900 году в Санкт-Петербурге.</p></body></html>",
+        "validation": {"is_valid": True, "is_ethical": True},
+        "answer": {
+            "answer": 1,
+            "reasoning": "ITMO University was founded in 1900 according to the official website.",
+            "sources": ["https://itmo.ru/ru/page/1"],
+        },
+    },
+}
+
+_QUERY_RE = re.compile(r"Query: (.*)\Z", re.S)
+_QUESTION_RE = re.compile(r"Question: (.*)\Z", re.S)
+PAGE_ETAG = '"stub-page-v1"'
+PAGE_LAST_MODIFIED = "Mon, 01 Sep 2025 00:00:00 GMT"
+
+
+def load_config(path: Optional[str]) -> Dict[str, Any]:
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    if path:
+        with open(path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(config.get(key), dict):
+                config[key].update(value)
+            else:
+                config[key] = value
+    return config
+
+
+async def simulate(backend: Dict[str, Any]) -> Optional[JSONResponse]:
+    """Sleep for a sampled latency and return an error response for failed calls."""
+    delay = random.lognormvariate(math.log(backend["median_ms"] / 1000), backend["sigma"])
+    await asyncio.sleep(delay)
+    if random.random() < backend["error_rate"]:
+        headers = {"Retry-After": "1"} if backend["error_status"] == 429 else None
+        return JSONResponse({"error": "stubbed failure"}, status_code=backend["error_status"], headers=headers)
+    return None
+
+
+def completion_content(prompt: str, payloads: Dict[str, Any]) -> str:
+    if "Analyze the following query" in prompt:
+        match = _QUERY_RE.search(prompt)
+        question = match.group(1).strip().splitlines()[0] if match else ""
+        return json.dumps(
+            {**payloads["validation"], "question_ru": question, "question_en": question},
+            ensure_ascii=False,
+        )
+    if "list the Google searches" in prompt:
+        # Planned agent's planning call
+        match = _QUESTION_RE.search(prompt)
+        question = match.group(1).strip().splitlines()[0] if match else ""
+        return json.dumps(
+            {"is_valid": True, "is_ethical": True, "queries": [question, f"{question} itmo.ru"], "refusal": None},
+            ensure_ascii=False,
+        )
+    answer = json.dumps(payloads["answer"], ensure_ascii=False)
+    if "Final Answer:" in prompt:
+        # ReAct agent prompt
+        return f"Thought: Do I need to use the tool? No\nFinal Answer: {answer}"
+    return answer
+
+
+def create_stub_app(config: Dict[str, Any]) -> FastAPI:
+    app = FastAPI(title="Upstream stand-ins")
+    app.state.calls = {"google": 0, "mistral": 0, "pages": 0, "pages_not_modified": 0}
+
+    @app.get("/customsearch/v1")
+    async def custom_search(request: Request, q: str, num: int = 10):
+        app.state.calls["google"] += 1
+        error = await simulate(config["google"])
+        if error is not None:
+            return error
+        items = config["payloads"]["search_items"][:num]
+        if config["serve_pages"]:
+            base_url = str(request.base_url).rstrip("/")
+            items = [{**item, "link": f"{base_url}/pages/{i}"} for i, item in enumerate(items, 1)]
+        return {"kind": "customsearch#search", "items": items}
+
+    @app.get("/pages/{page_id}")
+    async def page(request: Request, page_id: str):
+        app.state.calls["pages"] += 1
+        error = await simulate(config["pages"])
+        if error is not None:
+            return error
+        headers = {"ETag": PAGE_ETAG, "Last-Modified": PAGE_LAST_MODIFIED}
+        if request.headers.get("if-none-match") == PAGE_ETAG:
+            app.state.calls["pages_not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(config["payloads"]["page_html"], headers=headers)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.calls["mistral"] += 1
+        body = await request.json()
+        prompt = "\n".join(
+            message["content"] for message in body.get("messages", [])
+            if isinstance(message.get("content"), str)
+        )
+        error = await simulate(config["mistral"])
+        if error is not None:
+            return error
+
+        content = completion_content(prompt, config["payloads"])
+        completion_id = uuid.uuid4().hex
+        model = body.get("model", "stub")
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+
+        if body.get("stream"):
+            async def chunks():
+                step = 16
+                for i in range(0, len(content), step):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(config["mistral_stream_chunk_ms"] / 1000)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ],
+            "usage": usage,
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.calls
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run stand-in Google and Mistral servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--config", help="JSON file overriding DEFAULT_CONFIG")
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(load_config(args.config)), host=args.host, port=args.port, log_level="warning")
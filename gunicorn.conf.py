@@ -0,0 +1,40 @@
+import gc
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+# Load the app once in the master and fork the workers from it: imports and
+# read-only module state (prompts, templates, tool definitions) are shared
+# copy-on-write, network clients are created lazily in each worker
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+if preload_app:
+    # No collections in the master while the app loads, so the pages holding
+    # it are not dirtied before the first fork (pre_fork re-enables gc)
+    gc.disable()
+    # With the app preloaded, metrics are created before on_starting runs
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server):
+    # Samples left by a previous run would be aggregated into /metrics
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    # Objects that exist before the fork are never examined by the workers'
+    # collector, which would otherwise write to (and so copy) their pages.
+    # Frozen objects are skipped by the master's collector too, so gc can run
+    # again in the master (and is inherited enabled by the worker)
+    gc.freeze()
+    gc.enable()
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
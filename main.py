@@ -1,59 +1,111 @@
-import time
+import asyncio
+import hmac
+import json
+import math
+import os
 from typing import List, Optional
 
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import HttpUrl
 from schemas.request import PredictionRequest, PredictionResponse
 from utils.logger import setup_logger
-from src.services.llm_service import process_request
+from utils.admission import AdmissionController, AdmissionMiddleware
+from utils.deadline import DeadlineExceeded, deadline_scope, resolve_budget
+from utils.metrics import MetricsMiddleware, render_metrics
+from utils.request_logging import RequestLoggingMiddleware
+from utils.timing import StageTimingMiddleware
+from utils.tracing import TraceStore, TracingMiddleware
+from src.config import get_settings
+from src.cache.answer_cache import get_answer_cache
+from src.cache.faq_store import alookup_faq, get_faq_store
+from src.services.answering import answer_with_cache, answer_with_google_mistral
+from src.services.batch_service import run_batch
+from src.services.http_transport import close_http_transport
+from src.services import llm_service, planned_agent
 from src.services.google_mistral_service import GoogleMistralService
+from src.services.upstream import UpstreamUnavailable
 
 # Initialize
 app = FastAPI(title="ITMO University AI Agent")
 logger = None
 google_mistral_service = None
 
+settings = get_settings()
+trace_store = TraceStore(settings.TRACE_DIR, settings.TRACE_MAX_FILES)
+# /api/google-mistral runs the ReAct agent or the planned agent; each keeps its own cached answers
+if settings.AGENT_MODE == "planned":
+    process_request, agent_cache_namespace = planned_agent.process_request, "google-mistral-planned"
+else:
+    process_request, agent_cache_namespace = llm_service.process_request, "google-mistral"
+
+admission_controllers = {
+    path: AdmissionController(path, limit, settings.ADMISSION_MAX_QUEUE)
+    for path, limit in settings.ADMISSION_LIMITS.items()
+} if settings.ADMISSION_ENABLED else {}
+app.add_middleware(StageTimingMiddleware)
+# Inside the metrics middleware, so refused requests and queue time are measured
+app.add_middleware(
+    AdmissionMiddleware,
+    controllers=admission_controllers,
+    priority_classes=settings.ADMISSION_PRIORITY_CLASSES,
+    max_wait=settings.ADMISSION_MAX_WAIT,
+)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(
+    RequestLoggingMiddleware,
+    get_logger=lambda: logger,
+    body_limit=settings.LOG_BODY_LIMIT,
+    record_limit=settings.LOG_RECORD_LIMIT,
+    sample_rate=settings.LOG_SAMPLE_RATE,
+    route_sample_rates=settings.LOG_ROUTE_SAMPLE_RATES,
+)
+# Outermost, so traces include the time spent in the other middlewares
+app.add_middleware(
+    TracingMiddleware,
+    store=trace_store,
+    token=settings.ADMIN_TOKEN,
+    sample_rate=settings.TRACE_SAMPLE_RATE,
+    profile_sampled=settings.TRACE_PROFILE_SAMPLED,
+    profile_interval=settings.TRACE_PROFILE_INTERVAL,
+)
+
 
 @app.on_event("startup")
 async def startup_event():
     global logger, google_mistral_service
     logger = await setup_logger()
     google_mistral_service = GoogleMistralService()
+    # Loaded before the first request, later reloads run in a thread
+    get_faq_store()
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_http_transport()
 
-    body = await request.body()
-    await logger.info(
-        f"Incoming request: {request.method} {request.url}\n"
-        f"Request body: {body.decode()}"
-    )
 
-    response = await call_next(request)
-    process_time = time.time() - start_time
+def request_deadline(body: PredictionRequest, request: Request) -> float:
+    """Deadline of a request in seconds: its "deadline" field, the X-Request-Deadline header or the default."""
+    requested = body.deadline
+    if requested is None:
+        try:
+            requested = float(request.headers.get("x-request-deadline", ""))
+        except ValueError:
+            requested = None
+    return resolve_budget(requested, settings.REQUEST_DEADLINE, settings.REQUEST_DEADLINE_MAX)
 
-    response_body = b""
-    async for chunk in response.body_iterator:
-        response_body += chunk
 
-    await logger.info(
-        f"Request completed: {request.method} {request.url}\n"
-        f"Status: {response.status_code}\n"
-        f"Response body: {response_body.decode()}\n"
-        f"Duration: {process_time:.3f}s"
+def service_unavailable(error: UpstreamUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Upstream service {error.backend} is unavailable, retry later",
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
     )
 
-    return Response(
-        content=response_body,
-        status_code=response.status_code,
-        headers=dict(response.headers),
-        media_type=response.media_type,
-    )
 
 @app.post("/api/google-mistral", response_model=PredictionResponse)
-async def predict(body: PredictionRequest):
+async def predict(body: PredictionRequest, request: Request):
     """
     Process a query about ITMO University using an AI agent.
     
@@ -65,18 +117,32 @@ async def predict(body: PredictionRequest):
     try:
         await logger.info(f"Processing prediction request with id: {body.id}")
         
-        result = await process_request(body.query, str(body.id))
+        async def compute():
+            result = await process_request(body.query, str(body.id), body.session_id)
+            payload = {
+                "answer": result["metadata"]["answer"],
+                "reasoning": result["response"],
+                "sources": [str(HttpUrl(url)) for url in result["metadata"]["sources"][:3]],
+            }
+            return payload, result["status"] == "success"
 
-        response = PredictionResponse(
-            id=body.id,
-            answer=result["metadata"]["answer"],
-            reasoning=result["response"],
-            sources=[HttpUrl(url) for url in result["metadata"]["sources"][:3]]
-        )
+        with deadline_scope(request_deadline(body, request)):
+            if body.session_id is None:
+                payload = await answer_with_cache(agent_cache_namespace, body.query, compute)
+            else:
+                # Answers within a session depend on its history, so they bypass the cache
+                payload, _ = await compute()
+        response = PredictionResponse(id=body.id, **payload)
 
         await logger.info(f"Successfully processed request {body.id}")
         return response
 
+    except DeadlineExceeded as e:
+        await logger.error(f"Deadline exceeded for request {body.id}: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except UpstreamUnavailable as e:
+        await logger.error(f"Upstream unavailable for request {body.id}: {str(e)}")
+        raise service_unavailable(e)
     except ValueError as e:
         error_msg = str(e)
         await logger.error(f"Validation error for request {body.id}: {error_msg}")
@@ -86,7 +152,7 @@ async def predict(body: PredictionRequest):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/request", response_model=PredictionResponse)
-async def predict_google_mistral(body: PredictionRequest):
+async def predict_google_mistral(body: PredictionRequest, request: Request):
     """
     Process a query about ITMO University using Google Search and MistralAI.
     
@@ -98,18 +164,19 @@ async def predict_google_mistral(body: PredictionRequest):
     try:
         await logger.info(f"Processing google-mistral request with id: {body.id}")
         
-        result = await google_mistral_service.process_request(body.query, str(body.id))
-
-        response = PredictionResponse(
-            id=body.id,
-            answer=result["answer"],
-            reasoning=result["reasoning"],
-            sources=[HttpUrl(url) for url in result["sources"][:3]]
-        )
+        with deadline_scope(request_deadline(body, request)):
+            payload = await answer_with_google_mistral(google_mistral_service, body.query, str(body.id))
+        response = PredictionResponse(id=body.id, **payload)
 
         await logger.info(f"Successfully processed google-mistral request {body.id}")
         return response
 
+    except DeadlineExceeded as e:
+        await logger.error(f"Deadline exceeded for google-mistral request {body.id}: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except UpstreamUnavailable as e:
+        await logger.error(f"Upstream unavailable for google-mistral request {body.id}: {str(e)}")
+        raise service_unavailable(e)
     except ValueError as e:
         error_msg = str(e)
         await logger.error(f"Validation error for google-mistral request {body.id}: {error_msg}")
@@ -117,3 +184,186 @@ async def predict_google_mistral(body: PredictionRequest):
     except Exception as e:
         await logger.error(f"Internal error processing google-mistral request {body.id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+# How often a stream waiting for the model checks for a disconnected client
+STREAM_POLL_INTERVAL = 1.0
+
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/request/stream")
+async def predict_google_mistral_stream(body: PredictionRequest, request: Request):
+    """
+    Streaming variant of /api/request.
+
+    Responds with server-sent events: "answer" as soon as the answer number is
+    known, "reasoning" chunks while the explanation is generated, "sources"
+    and finally "done". Disconnecting stops the upstream generation.
+    """
+    settings = get_settings()
+    answer_cache = get_answer_cache("request")
+    payload = await alookup_faq(body.query)
+    if payload is None and settings.ANSWER_CACHE_ENABLED:
+        payload = await answer_cache.aget(body.query)
+
+    if payload is None:
+        try:
+            await logger.info(f"Processing streaming google-mistral request with id: {body.id}")
+            with deadline_scope(request_deadline(body, request)) as deadline:
+                context = await google_mistral_service.gather_context(body.query)
+        except DeadlineExceeded as e:
+            await logger.error(f"Deadline exceeded for streaming request {body.id}: {str(e)}")
+            raise HTTPException(status_code=504, detail=str(e))
+        except UpstreamUnavailable as e:
+            await logger.error(f"Upstream unavailable for streaming request {body.id}: {str(e)}")
+            raise service_unavailable(e)
+        except ValueError as e:
+            error_msg = str(e)
+            await logger.error(f"Validation error for streaming request {body.id}: {error_msg}")
+            raise HTTPException(status_code=400, detail=error_msg)
+        except Exception as e:
+            await logger.error(f"Internal error processing streaming request {body.id}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+    async def cached_events():
+        yield format_sse("answer", payload["answer"])
+        yield format_sse("reasoning", payload["reasoning"])
+        yield format_sse("sources", payload["sources"])
+        yield format_sse("done", {"id": body.id})
+
+    async def generated_events():
+        answer, reasoning, sources = None, [], []
+        # Only an answer whose JSON object was parsed to the end is cached
+        seen = set()
+        stream = google_mistral_service.stream_final_answer(
+            body.query, context["search_results"], context["screened"]
+        )
+        next_event = None
+        try:
+            while True:
+                # Wait for the model's next event in short slices, so a stalled
+                # stream is cut at the deadline and a gone client is noticed
+                if next_event is None:
+                    next_event = asyncio.ensure_future(stream.__anext__())
+                await asyncio.wait({next_event}, timeout=min(deadline.remaining(), STREAM_POLL_INTERVAL))
+                if await request.is_disconnected():
+                    await logger.info(f"Client disconnected from streaming request {body.id}")
+                    return
+                if not next_event.done():
+                    if not deadline.expired:
+                        continue
+                    # Out of time: end with the sources found instead of the model's
+                    await logger.error(f"Deadline exceeded while streaming request {body.id}")
+                    if not sources:
+                        partial = google_mistral_service.partial_answer(body.query, context["search_results"])
+                        yield format_sse("sources", partial["sources"])
+                    yield format_sse("done", {"id": body.id, "partial": True})
+                    return
+                try:
+                    event, data = next_event.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_event = None
+                seen.add(event)
+                if event == "complete":
+                    continue
+                if event == "answer":
+                    answer = data
+                elif event == "reasoning":
+                    reasoning.append(data)
+                elif event == "sources":
+                    sources = []
+                    for url in (data or [])[:3]:
+                        try:
+                            sources.append(str(HttpUrl(url)))
+                        except ValueError:
+                            continue
+                    data = sources
+                yield format_sse(event, data)
+        except Exception as e:
+            await logger.error(f"Internal error streaming request {body.id}: {str(e)}")
+            yield format_sse("error", {"detail": "Internal server error"})
+            return
+        finally:
+            if next_event is not None:
+                # Cancelling the pending step closes the upstream stream inside the generator
+                next_event.cancel()
+                await asyncio.gather(next_event, return_exceptions=True)
+            await stream.aclose()
+
+        yield format_sse("done", {"id": body.id})
+        if settings.ANSWER_CACHE_ENABLED and {"answer", "sources", "complete"} <= seen:
+            await answer_cache.aset(
+                body.query, {"answer": answer, "reasoning": "".join(reasoning), "sources": sources}
+            )
+
+    return StreamingResponse(
+        cached_events() if payload is not None else generated_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/batch")
+async def predict_batch(body: List[PredictionRequest], concurrency: Optional[int] = None):
+    """
+    Process many queries through the /api/request pipeline.
+
+    Repeated queries are answered once. Results are streamed back as JSON
+    lines in completion order; failed items carry "error" and "status".
+    """
+    settings = get_settings()
+    if len(body) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {settings.BATCH_MAX_ITEMS} items")
+
+    concurrency = min(concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    await logger.info(f"Processing batch of {len(body)} requests with concurrency {concurrency}")
+
+    async def lines():
+        # Items share the /api/request pool at the lowest priority, so interactive requests go first
+        async for result in run_batch(
+            google_mistral_service,
+            body,
+            concurrency,
+            admission_controllers.get("/api/request"),
+            len(settings.ADMISSION_PRIORITY_CLASSES) - 1,
+        ):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics aggregated across all gunicorn workers."""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+def check_admin_token(request: Request) -> None:
+    token = request.headers.get("x-admin-token", "")
+    if not settings.ADMIN_TOKEN or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/admin/traces")
+async def list_traces(request: Request):
+    """Saved request traces, newest first. Requires the X-Admin-Token header."""
+    check_admin_token(request)
+    return {"traces": trace_store.list()}
+
+
+@app.get("/admin/traces/{trace_id}")
+async def download_trace(trace_id: str, request: Request):
+    """Download one trace as gzipped JSON. Requires the X-Admin-Token header."""
+    check_admin_token(request)
+    if not TraceStore.valid_id(trace_id):
+        raise HTTPException(status_code=404, detail="Trace not found")
+    path = trace_store.path_for(trace_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return FileResponse(path, media_type="application/gzip", filename=f"{trace_id}.json.gz")
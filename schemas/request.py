@@ -6,6 +6,9 @@ from pydantic import BaseModel, HttpUrl
 class PredictionRequest(BaseModel):
     id: int
     query: str
+    session_id: Optional[str] = None
+    # Seconds the client is willing to wait, capped by REQUEST_DEADLINE_MAX
+    deadline: Optional[float] = None
 
 
 class PredictionResponse(BaseModel):
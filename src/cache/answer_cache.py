@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import logging
+import re
+import string
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.cache.backends import CacheBackend, create_backend
+from src.config import get_settings
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_OPTION_RE = re.compile(r"^\s*(\d{1,2})\s*[.)]\s*(.+?)\s*$")
+_WHITESPACE_RE = re.compile(r"\s+")
+_PUNCTUATION_TABLE = str.maketrans({ch: " " for ch in string.punctuation + "«»—–…“”„"})
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+CANONICALIZATION_STEPS = ("lowercase", "whitespace", "punctuation", "option_order")
+
+# MinHash parameters: 16 bands of 4 rows give ~50% match probability at
+# Jaccard 0.5 and ~99% at 0.85, the final decision uses the full signature
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def split_query(query: str) -> Tuple[str, List[str]]:
+    """Split a query into the question text and its numbered answer options."""
+    question_lines = []
+    options = []
+    for line in query.splitlines():
+        match = _OPTION_RE.match(line)
+        if match:
+            options.append(match.group(2))
+        elif not options:
+            question_lines.append(line)
+        else:
+            # Continuation of the previous option
+            options[-1] = f"{options[-1]} {line.strip()}"
+    return "\n".join(question_lines), options
+
+
+def _normalize_text(text: str, steps: Sequence[str]) -> str:
+    if "lowercase" in steps:
+        text = text.lower()
+    if "punctuation" in steps:
+        text = text.translate(_PUNCTUATION_TABLE)
+    if "whitespace" in steps:
+        text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text
+
+
+def canonicalize_query(query: str, steps: Sequence[str] = CANONICALIZATION_STEPS) -> Tuple[str, List[str]]:
+    """
+    Build the canonical form of a query.
+
+    Args:
+        query: Raw user query, optionally followed by numbered answer options
+        steps: Subset of CANONICALIZATION_STEPS to apply
+
+    Returns:
+        Tuple of the canonical text and the normalized options in their
+        original order (used to map cached answer numbers back to this query)
+    """
+    question, options = split_query(query)
+    question = _normalize_text(question, steps)
+    options = [_normalize_text(option, steps) for option in options]
+    ordered = sorted(options) if "option_order" in steps else options
+    canonical = "\n".join([question] + [f"- {option}" for option in ordered])
+    return canonical, options
+
+
+def _shingles(text: str, size: int = 1) -> List[str]:
+    # Queries are short, so word unigrams tolerate an inserted word far better
+    # than longer shingles do
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) < size:
+        return tokens
+    return [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+@lru_cache(maxsize=1)
+def _permutations() -> List[Tuple[int, int]]:
+    # Deterministic so every worker computes identical signatures
+    params = []
+    for i in range(MINHASH_PERMUTATIONS):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "big") % _MERSENNE_PRIME or 1
+        b = int.from_bytes(digest[8:], "big") % _MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+
+def minhash_signature(text: str) -> List[int]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in set(_shingles(text))
+    ]
+    if not hashes:
+        return []
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _permutations()]
+
+
+def estimate_similarity(left: Sequence[int], right: Sequence[int]) -> float:
+    if not left or len(left) != len(right):
+        return 0.0
+    return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+def to_canonical(options: List[str], payload: Dict) -> Dict:
+    """Store the chosen option's text next to its number, so the answer survives reordered options."""
+    entry = dict(payload)
+    answer = payload.get("answer")
+    if options and isinstance(answer, int) and 1 <= answer <= len(options):
+        entry["answer_option"] = options[answer - 1]
+    return entry
+
+
+def from_canonical(options: List[str], entry: Dict) -> Optional[Dict]:
+    """Payload for a query with these options, None when the chosen option is not among them."""
+    payload = {k: v for k, v in entry.items() if k not in ("answer_option", "signature")}
+    answer_option = entry.get("answer_option")
+    if answer_option is not None:
+        if answer_option not in options:
+            return None
+        payload["answer"] = options.index(answer_option) + 1
+    return payload
+
+
+class AnswerCache:
+    """
+    Cache of final answer payloads (answer/reasoning/sources) keyed by the
+    canonical query.
+
+    The answer number is stored as the text of the chosen option, so a query
+    with the same options in a different order still gets the right number.
+    """
+
+    MAX_BUCKET_SIZE = 32
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        namespace: str,
+        ttl: Optional[float] = None,
+        steps: Sequence[str] = CANONICALIZATION_STEPS,
+        near_duplicates: bool = False,
+        similarity_threshold: float = 0.85,
+    ):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.steps = tuple(steps)
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+
+    def key_for(self, query: str) -> str:
+        canonical, _ = canonicalize_query(query, self.steps)
+        return self._entry_key(canonical)
+
+    def _entry_key(self, canonical: str) -> str:
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        return f"answer:{self.namespace}:{digest}"
+
+    def _band_keys(self, signature: List[int]) -> List[str]:
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        keys = []
+        for band in range(MINHASH_BANDS):
+            chunk = ",".join(str(v) for v in signature[band * rows:(band + 1) * rows])
+            digest = hashlib.blake2b(chunk.encode(), digest_size=8).hexdigest()
+            keys.append(f"answer:{self.namespace}:band:{band}:{digest}")
+        return keys
+
+    def remap(self, source_query: str, target_query: str, payload: Dict) -> Optional[Dict]:
+        """Translate a payload computed for source_query to the option order of target_query."""
+        _, source_options = canonicalize_query(source_query, self.steps)
+        _, target_options = canonicalize_query(target_query, self.steps)
+        return from_canonical(target_options, to_canonical(source_options, payload))
+
+    def get(self, query: str) -> Optional[Dict]:
+        canonical, options = canonicalize_query(query, self.steps)
+        try:
+            entry = self.backend.get(self._entry_key(canonical))
+            if entry is not None:
+                payload = from_canonical(options, entry)
+                if payload is not None:
+                    CACHE_LOOKUPS.labels(f"answer_{self.namespace}", "hit").inc()
+                    return payload
+
+            if self.near_duplicates:
+                payload = self._get_near_duplicate(canonical, options)
+                if payload is not None:
+                    CACHE_LOOKUPS.labels(f"answer_{self.namespace}", "near_hit").inc()
+                    return payload
+        except Exception as e:
+            logger.warning("Answer cache read error: %s", e)
+
+        CACHE_LOOKUPS.labels(f"answer_{self.namespace}", "miss").inc()
+        return None
+
+    def _get_near_duplicate(self, canonical: str, options: List[str]) -> Optional[Dict]:
+        signature = minhash_signature(canonical)
+        if not signature:
+            return None
+
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self.backend.get(band_key) or [])
+
+        best_score, best_payload = 0.0, None
+        for key in candidates:
+            entry = self.backend.get(key)
+            if entry is None:
+                continue
+            score = estimate_similarity(signature, entry.get("signature") or [])
+            if score >= self.similarity_threshold and score > best_score:
+                payload = from_canonical(options, entry)
+                if payload is not None:
+                    best_score, best_payload = score, payload
+        return best_payload
+
+    def set(self, query: str, payload: Dict) -> None:
+        canonical, options = canonicalize_query(query, self.steps)
+        key = self._entry_key(canonical)
+        entry = to_canonical(options, payload)
+        try:
+            if self.near_duplicates:
+                entry["signature"] = minhash_signature(canonical)
+                for band_key in self._band_keys(entry["signature"]) if entry["signature"] else []:
+                    bucket = self.backend.get(band_key) or []
+                    if key not in bucket:
+                        bucket = (bucket + [key])[-self.MAX_BUCKET_SIZE:]
+                        self.backend.set(band_key, bucket, ttl=self.ttl)
+            self.backend.set(key, entry, ttl=self.ttl)
+        except Exception as e:
+            logger.warning("Answer cache write error: %s", e)
+
+    async def aget(self, query: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.get, query)
+
+    async def aset(self, query: str, payload: Dict) -> None:
+        await asyncio.to_thread(self.set, query, payload)
+
+
+@lru_cache()
+def get_answer_cache(namespace: str) -> AnswerCache:
+    settings = get_settings()
+    backend = create_backend(
+        settings.ANSWER_CACHE_BACKEND,
+        settings.ANSWER_CACHE_PATH,
+        max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+        default_ttl=settings.ANSWER_CACHE_TTL,
+        table="answer_cache",
+    )
+    return AnswerCache(
+        backend,
+        namespace=namespace,
+        ttl=settings.ANSWER_CACHE_TTL,
+        steps=settings.ANSWER_CACHE_CANONICALIZATION,
+        near_duplicates=settings.ANSWER_CACHE_NEAR_DUPLICATES,
+        similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    )
@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class CacheBackend:
+    """Key/value store with a per-entry TTL and a bounded number of entries."""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Process-local LRU cache, useful for a single worker or for development."""
+
+    def __init__(self, max_entries: int = 1000, default_ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries: "OrderedDict[str, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    On-disk cache shared by every worker process on the host.
+
+    Values are stored as JSON. The database runs in WAL mode so readers in one
+    worker never block a writer in another. A hit refreshes the entry's
+    access time only when it is older than a tenth of the TTL (at most
+    ACCESS_UPDATE_INTERVAL), so most reads take no write lock.
+
+    When the table grows past max_entries, expired rows are dropped first and
+    then the least recently used ones. The size is checked every
+    EVICTION_CHECK_WRITES writes or EVICTION_CHECK_SECONDS seconds of one
+    process, whichever comes first, so max_entries is a soft bound: each
+    worker may add up to EVICTION_CHECK_WRITES rows before it checks.
+    """
+
+    # Eviction needs a COUNT(*), so it is not checked on every write
+    EVICTION_CHECK_WRITES = 50
+    EVICTION_CHECK_SECONDS = 10.0
+    ACCESS_UPDATE_INTERVAL = 5 * 60.0
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10000,
+        default_ttl: Optional[float] = None,
+        table: str = "cache",
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        self._evicted_at = time.monotonic()
+        self.access_update_interval = (
+            min(default_ttl / 10, self.ACCESS_UPDATE_INTERVAL) if default_ttl else self.ACCESS_UPDATE_INTERVAL
+        )
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at "
+                f"ON {self.table} (accessed_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads or across fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return None
+        if now - accessed_at >= self.access_update_interval:
+            conn.execute(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+        )
+        self._writes += 1
+        if (
+            self._writes >= self.EVICTION_CHECK_WRITES
+            or time.monotonic() - self._evicted_at >= self.EVICTION_CHECK_SECONDS
+        ):
+            self.evict()
+
+    def delete(self, key: str) -> None:
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+    def evict(self) -> None:
+        self._writes = 0
+        self._evicted_at = time.monotonic()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),),
+            )
+            (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            overflow = count - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+
+
+def create_backend(
+    kind: str, path: str, max_entries: int, default_ttl: Optional[float], table: str = "cache"
+) -> CacheBackend:
+    if kind == "sqlite":
+        return SQLiteCacheBackend(path, max_entries=max_entries, default_ttl=default_ttl, table=table)
+    if kind == "memory":
+        return MemoryCacheBackend(max_entries=max_entries, default_ttl=default_ttl)
+    raise ValueError(f"Unknown cache backend: {kind}")
@@ -0,0 +1,56 @@
+"""
+Build or refresh the precomputed FAQ store from a curated question list.
+
+The list is a JSONL file of PredictionRequest items ({"id": ..., "query": ...}),
+the same format batch_runner.py reads. Questions answered less than --max-age
+seconds ago are kept; the rest go through the /api/request pipeline. With
+--every the refresh is repeated on that interval.
+
+Usage:
+    python -m src.cache.build_faq questions.jsonl --store cache/faq.json --every 21600
+"""
+import argparse
+import asyncio
+import time
+
+from batch_runner import read_items
+from src.cache.faq_store import read_entries, refresh_entries, write_entries
+from src.config import get_settings
+from src.services.google_mistral_service import GoogleMistralService
+
+
+async def main(args: argparse.Namespace) -> None:
+    service = GoogleMistralService()
+    steps = get_settings().ANSWER_CACHE_CANONICALIZATION
+    while True:
+        start_time = time.time()
+        queries = [item.query for item in read_items(args.input)]
+        entries = read_entries(args.store)
+        stats = await refresh_entries(service, queries, entries, args.max_age, args.concurrency, steps)
+        write_entries(args.store, entries)
+        print(
+            f"Stored {len(entries)} answers in {time.time() - start_time:.1f}s "
+            f"(refreshed {stats['refreshed']}, fresh {stats['fresh']}, "
+            f"failed {stats['failed']}, removed {stats['removed']})",
+            flush=True,
+        )
+        if not args.every:
+            break
+        await asyncio.sleep(args.every)
+
+
+if __name__ == "__main__":
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Precompute answers to frequent ITMO questions")
+    parser.add_argument("input", help="JSONL file with PredictionRequest items")
+    parser.add_argument("--store", default=settings.FAQ_PATH, help="Where the FAQ store is written")
+    parser.add_argument(
+        "--max-age", type=float, default=settings.FAQ_REFRESH_AGE,
+        help="Recompute answers older than this many seconds",
+    )
+    parser.add_argument(
+        "--concurrency", "-c", type=int, default=settings.BATCH_CONCURRENCY,
+        help="Maximum number of pipelines running at once",
+    )
+    parser.add_argument("--every", type=float, default=0, help="Repeat the refresh every this many seconds")
+    asyncio.run(main(parser.parse_args()))
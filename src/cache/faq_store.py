@@ -0,0 +1,187 @@
+"""
+Precomputed answers to frequent questions.
+
+The store is a JSON file written by src/cache/build_faq.py: one entry per
+curated question with its answer payload and the time it was last computed.
+Workers load it into memory and index every entry by its exact (stripped)
+query and by its canonical form, so a lookup is a dict access. Entries older
+than FAQ_MAX_AGE are not served, and a rebuilt file is picked up within
+FAQ_RELOAD_INTERVAL seconds without a restart. The file is loaded at startup;
+on the request path it is only re-read in a worker thread.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from pydantic import HttpUrl
+
+from src.cache.answer_cache import CANONICALIZATION_STEPS, canonicalize_query, from_canonical, to_canonical
+from src.config import get_settings
+from utils.deadline import deadline_scope
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+FAQ_VERSION = 1
+
+
+def make_entry(query: str, payload: Dict, steps: Sequence[str] = CANONICALIZATION_STEPS) -> Dict:
+    _, options = canonicalize_query(query, steps)
+    return {"query": query, "refreshed_at": time.time(), "payload": to_canonical(options, payload)}
+
+
+def read_entries(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != FAQ_VERSION:
+        raise ValueError(f"Unsupported FAQ store version {data.get('version')}")
+    return data["entries"]
+
+
+def write_entries(path: str, entries: List[Dict]) -> None:
+    """Write the store atomically, so workers never read a half-written file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": FAQ_VERSION, "built_at": time.time(), "entries": entries},
+            f, ensure_ascii=False, separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+
+async def refresh_entries(
+    service, queries: List[str], entries: List[Dict], max_age: float, concurrency: int,
+    steps: Sequence[str] = CANONICALIZATION_STEPS,
+) -> Dict[str, int]:
+    """
+    Bring entries up to date with the question list, in place.
+
+    Entries younger than max_age are kept as they are; the other questions are
+    run through service.process_request. Only complete answers with sources
+    replace an entry, so a failed refresh keeps serving the previous answer
+    until it goes stale. Entries for questions no longer listed are dropped.
+    """
+    settings = get_settings()
+    existing = {entry["query"]: entry for entry in entries}
+    queries = list(dict.fromkeys(queries))
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"fresh": 0, "refreshed": 0, "failed": 0, "removed": len(set(existing) - set(queries))}
+
+    async def refresh(query: str) -> Optional[Dict]:
+        entry = existing.get(query)
+        if entry is not None and time.time() - entry["refreshed_at"] < max_age:
+            stats["fresh"] += 1
+            return entry
+        async with semaphore:
+            try:
+                with deadline_scope(settings.REQUEST_DEADLINE):
+                    result = await service.process_request(query, "faq")
+                if result.get("partial") or result.get("error") or not result["sources"]:
+                    raise ValueError("incomplete answer")
+                payload = {
+                    "answer": result["answer"],
+                    "reasoning": result["reasoning"],
+                    "sources": [str(HttpUrl(url)) for url in result["sources"][:3]],
+                }
+            except Exception as e:
+                logger.warning("Failed to answer FAQ question %r: %s", query, e)
+                stats["failed"] += 1
+                return entry
+        stats["refreshed"] += 1
+        return make_entry(query, payload, steps)
+
+    refreshed = await asyncio.gather(*(refresh(query) for query in queries))
+    entries[:] = [entry for entry in refreshed if entry is not None]
+    return stats
+
+
+class FAQStore:
+    def __init__(self, entries: List[Dict], max_age: float, steps: Sequence[str] = CANONICALIZATION_STEPS):
+        self.entries = entries
+        self.max_age = max_age
+        self.steps = tuple(steps)
+        self.exact: Dict[str, int] = {}
+        self.canonical: Dict[str, int] = {}
+        for index, entry in enumerate(entries):
+            self.exact[entry["query"].strip()] = index
+            canonical, _ = canonicalize_query(entry["query"], self.steps)
+            self.canonical.setdefault(canonical, index)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, query: str) -> Optional[Dict]:
+        """Answer payload for query, or None when it is not a (fresh) FAQ entry."""
+        index = self.exact.get(query.strip())
+        canonical, options = canonicalize_query(query, self.steps)
+        if index is None:
+            index = self.canonical.get(canonical)
+        if index is None:
+            CACHE_LOOKUPS.labels("faq", "miss").inc()
+            return None
+
+        entry = self.entries[index]
+        if time.time() - entry["refreshed_at"] > self.max_age:
+            CACHE_LOOKUPS.labels("faq", "stale").inc()
+            return None
+        payload = from_canonical(options, entry["payload"])
+        CACHE_LOOKUPS.labels("faq", "hit" if payload is not None else "miss").inc()
+        return payload
+
+
+_faq_store: Optional[FAQStore] = None
+_faq_store_mtime: Optional[float] = None
+_faq_store_checked_at = 0.0
+_faq_store_lock = threading.Lock()
+
+
+def _reload_due(settings) -> bool:
+    return not _faq_store_checked_at or time.monotonic() - _faq_store_checked_at >= settings.FAQ_RELOAD_INTERVAL
+
+
+def get_faq_store() -> Optional[FAQStore]:
+    """
+    Return the worker's FAQ store, or None when it is disabled or not built.
+
+    The file's mtime is re-checked at most every FAQ_RELOAD_INTERVAL seconds.
+    """
+    global _faq_store, _faq_store_mtime, _faq_store_checked_at
+    settings = get_settings()
+    if not settings.FAQ_ENABLED:
+        return None
+
+    with _faq_store_lock:
+        if not _reload_due(settings):
+            return _faq_store
+        _faq_store_checked_at = time.monotonic()
+
+        try:
+            mtime = os.path.getmtime(settings.FAQ_PATH)
+        except OSError:
+            _faq_store, _faq_store_mtime = None, None
+            return None
+        if mtime != _faq_store_mtime:
+            try:
+                _faq_store = FAQStore(
+                    read_entries(settings.FAQ_PATH), settings.FAQ_MAX_AGE, settings.ANSWER_CACHE_CANONICALIZATION
+                )
+                _faq_store_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Failed to load FAQ store: %s", e)
+        return _faq_store
+
+
+async def alookup_faq(query: str) -> Optional[Dict]:
+    """FAQ answer for query; when a reload check is due, the file is read in a thread."""
+    settings = get_settings()
+    if not settings.FAQ_ENABLED:
+        return None
+    store = await asyncio.to_thread(get_faq_store) if _reload_due(settings) else _faq_store
+    return store.lookup(query) if store is not None else None
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from src.cache.backends import CacheBackend, create_backend
+from src.config import get_settings
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different queries share an entry."""
+    return _WHITESPACE_RE.sub(" ", query).strip().lower()
+
+
+def make_cache_key(query: str, language: Optional[str] = None) -> str:
+    normalized = normalize_query(query)
+    digest = hashlib.sha256(f"{language or ''}\x00{normalized}".encode("utf-8")).hexdigest()
+    return f"search:{digest}"
+
+
+class SearchCache:
+    """
+    Search result cache shared by GoogleMistralService and the agent's search tool.
+
+    An empty result is kept only for empty_ttl seconds (not at all when 0),
+    so a query is retried soon after Google had nothing for it.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        ttl: Optional[float] = None,
+        empty_ttl: float = 0,
+        enabled: bool = True,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self.enabled = enabled
+
+    def get(self, query: str, language: Optional[str] = None) -> Optional[List[Dict]]:
+        if not self.enabled:
+            return None
+
+        try:
+            results = self.backend.get(make_cache_key(query, language))
+        except Exception as e:
+            # A broken cache must never fail the request, treat it as a miss
+            logger.warning("Search cache read error: %s", e)
+            results = None
+
+        if results is None:
+            CACHE_LOOKUPS.labels("search", "miss").inc()
+        else:
+            CACHE_LOOKUPS.labels("search", "hit").inc()
+        return results
+
+    def set(self, query: str, results: List[Dict], language: Optional[str] = None) -> None:
+        if not self.enabled or (not results and not self.empty_ttl):
+            return
+
+        try:
+            ttl = self.ttl if results else self.empty_ttl
+            self.backend.set(make_cache_key(query, language), results, ttl=ttl)
+        except Exception as e:
+            logger.warning("Search cache write error: %s", e)
+
+    async def aget(self, query: str, language: Optional[str] = None) -> Optional[List[Dict]]:
+        return await asyncio.to_thread(self.get, query, language)
+
+    async def aset(self, query: str, results: List[Dict], language: Optional[str] = None) -> None:
+        await asyncio.to_thread(self.set, query, results, language)
+
+
+@lru_cache()
+def get_search_cache() -> SearchCache:
+    settings = get_settings()
+    backend = create_backend(
+        settings.SEARCH_CACHE_BACKEND,
+        settings.SEARCH_CACHE_PATH,
+        max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+        default_ttl=settings.SEARCH_CACHE_TTL,
+        table="search_cache",
+    )
+    return SearchCache(
+        backend,
+        ttl=settings.SEARCH_CACHE_TTL,
+        empty_ttl=settings.SEARCH_CACHE_EMPTY_TTL,
+        enabled=settings.SEARCH_CACHE_ENABLED,
+    )
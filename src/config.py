@@ -1,15 +1,203 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
     MISTRAL_API_KEY: str
     GOOGLE_API_KEY: str
     GOOGLE_CSE_ID: str  # Custom Search Engine ID
-    MODEL_NAME: str = "mistral-medium"
+    MODEL_NAME: str = "mistral-medium"  # Stages without a route, including the ReAct agent
     TEMPERATURE: float = 0.7
     MAX_TOKENS: int = 2000
 
+    # Model per LLM stage (validation, answer, plan, synthesis, agent). Stages in
+    # MODEL_ESCALATIONS are repeated with that model when the routed model's output
+    # does not parse or its confidence is below MODEL_ESCALATION_MIN_CONFIDENCE
+    MODEL_ROUTES: Dict[str, str] = {
+        "validation": "mistral-small-latest",
+        "answer": "mistral-large-latest",
+        "plan": "mistral-small-latest",
+        "synthesis": "mistral-large-latest",
+    }
+    MODEL_ESCALATIONS: Dict[str, str] = {
+        "validation": "mistral-large-latest",
+        "plan": "mistral-large-latest",
+    }
+    MODEL_ESCALATION_ENABLED: bool = True
+    MODEL_ESCALATION_MIN_CONFIDENCE: float = 0.6
+
+    # Upstream base URLs, overridden to point at local stand-ins in benchmarks
+    MISTRAL_SERVER_URL: Optional[str] = None
+    GOOGLE_API_ENDPOINT: Optional[str] = None
+
+    # Connection pools shared by all outgoing HTTP calls of a worker
+    # (src/services/http_transport.py): connections to Mistral and to Google,
+    # connections shared by all fetched pages, idle keep-alive, HTTP/2 and how
+    # long resolved host names are reused
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 20
+    HTTP_MAX_PAGE_CONNECTIONS: int = 100
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP2_ENABLED: bool = True
+    DNS_CACHE_TTL: float = 300.0
+
+    # Request logging: bytes of each body kept, record size cap and sampling
+    # (LOG_ROUTE_SAMPLE_RATES maps path prefixes to rates, e.g. {"/api/batch": 0.1})
+    LOG_BODY_LIMIT: int = 1024
+    LOG_RECORD_LIMIT: int = 4096
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_ROUTE_SAMPLE_RATES: Dict[str, float] = {"/metrics": 0.0}
+
+    # End-to-end deadline of one request in seconds, overridable per request with
+    # the "deadline" field or the X-Request-Deadline header up to REQUEST_DEADLINE_MAX.
+    # Validation and search get a share of the time left, the answer gets the rest.
+    REQUEST_DEADLINE: float = 25.0
+    REQUEST_DEADLINE_MAX: float = 60.0
+    DEADLINE_VALIDATION_SHARE: float = 0.4
+    DEADLINE_SEARCH_SHARE: float = 0.3
+    DEADLINE_PAGE_FETCH_SHARE: float = 0.2
+    # Ceilings for a single Mistral and Google call
+    MISTRAL_TIMEOUT: float = 20.0
+    GOOGLE_TIMEOUT: float = 10.0
+    # A second Google call is started when the first one is slower than this
+    # percentile of recent Google latencies (GOOGLE_HEDGE_DEFAULT_DELAY until there are enough samples)
+    GOOGLE_HEDGE_ENABLED: bool = True
+    GOOGLE_HEDGE_PERCENTILE: float = 95.0
+    GOOGLE_HEDGE_MIN_DELAY: float = 0.3
+    GOOGLE_HEDGE_DEFAULT_DELAY: float = 1.5
+
+    # Upstream protection (src/services/upstream.py), per worker: client-side rate
+    # limits in requests per second, retries and circuit breakers
+    MISTRAL_RATE_LIMIT: float = 2.0
+    MISTRAL_RATE_BURST: int = 5
+    GOOGLE_RATE_LIMIT: float = 2.0
+    GOOGLE_RATE_BURST: int = 10
+    UPSTREAM_MAX_ATTEMPTS: int = 3
+    UPSTREAM_BACKOFF_BASE: float = 0.25
+    UPSTREAM_BACKOFF_MAX: float = 4.0
+    # A longer Retry-After is not waited for, the request fails with 503
+    UPSTREAM_RETRY_AFTER_MAX: float = 10.0
+    UPSTREAM_MAX_QUEUE_WAIT: float = 5.0
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_TIMEOUT: float = 30.0
+
+    # Admission control, per worker: concurrent requests per endpoint, waiting
+    # queue size and how long each priority class (X-Priority header, highest
+    # priority first) may wait for a slot before getting 503
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_LIMITS: Dict[str, int] = {
+        "/api/request": 16,
+        "/api/request/stream": 8,
+        "/api/google-mistral": 8,
+        "/api/batch": 2,
+    }
+    ADMISSION_MAX_QUEUE: int = 64
+    ADMISSION_PRIORITY_CLASSES: List[str] = ["interactive", "batch"]
+    ADMISSION_MAX_WAIT: Dict[str, float] = {"interactive": 5.0, "batch": 30.0}
+
+    # Guards the /admin endpoints; also the value of the X-Debug-Trace header
+    # that turns on tracing for a request (admin and debug traces are off when unset)
+    ADMIN_TOKEN: Optional[str] = None
+    # Per-request traces (span tree, optional CPU profile) written to TRACE_DIR
+    TRACE_DIR: str = "cache/traces"
+    TRACE_MAX_FILES: int = 200
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_PROFILE_SAMPLED: bool = False
+    TRACE_PROFILE_INTERVAL: float = 0.005
+    # Agent behind /api/google-mistral: "react" (AgentExecutor loop) or "planned"
+    # (one planning call, concurrent searches, one synthesis call)
+    AGENT_MODE: str = "react"
+    PLANNED_AGENT_MAX_QUERIES: int = 4
+    # Print the ReAct agent's steps to stdout
+    AGENT_VERBOSE: bool = False
+
+    # Skip the LLM validation call when the local pre-classifier is confident
+    PRECLASSIFIER_ENABLED: bool = True
+    # On that fast path, also search the question as is in the other language,
+    # as the LLM validation path searches in both (false: one search, less recall)
+    PRECLASSIFIER_SEARCH_BOTH_LANGUAGES: bool = True
+    # Search on the locally extracted question while the LLM validation runs,
+    # topping up with the extracted question when similarity falls below the threshold
+    SPECULATIVE_SEARCH_ENABLED: bool = True
+    SPECULATIVE_SEARCH_SIMILARITY: float = 0.5
+
+    # Search context packing: token budgets for the answer prompt and for one
+    # agent tool call, and the score bonus for itmo.ru pages
+    CONTEXT_TOKEN_BUDGET: int = 1500
+    CONTEXT_TOOL_TOKEN_BUDGET: int = 800
+    CONTEXT_ITMO_BOOST: float = 1.0
+
+    # Local itmo.ru index queried before Google (see src/retrieval/build_index.py);
+    # Google is used when the best BM25 score is below LOCAL_INDEX_MIN_SCORE
+    LOCAL_INDEX_ENABLED: bool = True
+    LOCAL_INDEX_PATH: str = "cache/itmo_index"
+    LOCAL_INDEX_MIN_SCORE: float = 10.0
+    LOCAL_INDEX_TOP_K: int = 5
+    LOCAL_INDEX_RELOAD_INTERVAL: float = 60.0
+
+    # Fetching the top result pages for passages beyond Google's snippets
+    PAGE_FETCH_ENABLED: bool = True
+    PAGE_FETCH_TOP_N: int = 3
+    PAGE_FETCH_DEADLINE: float = 3.0
+    PAGE_FETCH_TIMEOUT: float = 3.0
+    PAGE_FETCH_PER_HOST_LIMIT: int = 4
+    PAGE_FETCH_MAX_BYTES: int = 1_000_000
+    PAGE_CACHE_BACKEND: str = "sqlite"
+    PAGE_CACHE_PATH: str = "cache/page_cache.db"
+    # Cached pages are served as is for PAGE_CACHE_FRESH_TTL, then revalidated
+    PAGE_CACHE_FRESH_TTL: float = 60 * 60
+    PAGE_CACHE_TTL: float = 7 * 24 * 60 * 60
+    PAGE_CACHE_MAX_ENTRIES: int = 5000
+
+    # Search result cache shared by all workers ("sqlite" or "memory")
+    SEARCH_CACHE_ENABLED: bool = True
+    SEARCH_CACHE_BACKEND: str = "sqlite"
+    SEARCH_CACHE_PATH: str = "cache/search_cache.db"
+    SEARCH_CACHE_TTL: float = 24 * 60 * 60
+    # Searches that found nothing are cached this long (0 to not cache them)
+    SEARCH_CACHE_EMPTY_TTL: float = 5 * 60
+    SEARCH_CACHE_MAX_ENTRIES: int = 5000
+
+    # Final answer cache in front of both endpoints
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_BACKEND: str = "sqlite"
+    ANSWER_CACHE_PATH: str = "cache/answer_cache.db"
+    ANSWER_CACHE_TTL: float = 6 * 60 * 60
+    ANSWER_CACHE_MAX_ENTRIES: int = 20000
+    # Any of: lowercase, whitespace, punctuation, option_order
+    ANSWER_CACHE_CANONICALIZATION: List[str] = ["lowercase", "whitespace", "punctuation", "option_order"]
+    ANSWER_CACHE_NEAR_DUPLICATES: bool = False
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.85
+
+    # Precomputed answers to frequent questions (built by src/cache/build_faq.py),
+    # looked up before the answer cache
+    FAQ_ENABLED: bool = True
+    FAQ_PATH: str = "cache/faq.json"
+    # Entries older than this are not served; the build job recomputes entries
+    # older than FAQ_REFRESH_AGE, so a refresh cycle shorter than the difference
+    # keeps every answer served
+    FAQ_MAX_AGE: float = 7 * 24 * 60 * 60
+    FAQ_REFRESH_AGE: float = 24 * 60 * 60
+    FAQ_RELOAD_INTERVAL: float = 60.0
+
+    # Share one in-flight pipeline between concurrent identical queries (within a
+    # worker: identical queries on different workers are each computed once)
+    REQUEST_COALESCING_ENABLED: bool = True
+
+    # Agent conversation memory, kept per session id and shared by all workers
+    # ("sqlite" or "memory"); at most SESSION_MAX_SESSIONS * SESSION_MAX_TOKENS in total
+    SESSION_BACKEND: str = "sqlite"
+    SESSION_PATH: str = "cache/sessions.db"
+    SESSION_MAX_SESSIONS: int = 1000
+    SESSION_MAX_MESSAGES: int = 20
+    SESSION_MAX_TOKENS: int = 4000
+    SESSION_TTL: float = 30 * 60
+
+    # Batch processing (/api/batch and batch_runner.py)
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_CONCURRENCY: int = 32
+    BATCH_MAX_ITEMS: int = 10000
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,29 @@
+"""
+Build or incrementally update the local itmo.ru index from a snapshot directory.
+
+Pages are HTML or text files stored as <host>/<path>.html (e.g.
+itmo.ru/ru/page/123.html); a <link rel="canonical"> in the page or a
+leading "URL: ..." line in a text file overrides the derived URL.
+
+Usage:
+    python -m src.retrieval.build_index snapshot/ --index-dir cache/itmo_index
+"""
+import argparse
+import time
+
+from src.retrieval.index import IndexBuilder
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index a snapshot of itmo.ru pages")
+    parser.add_argument("snapshot_dir", help="Directory with HTML/text pages")
+    parser.add_argument("--index-dir", default="cache/itmo_index", help="Where the index is stored")
+    parser.add_argument("--passage-words", type=int, default=120, help="Maximum words per passage")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    stats = IndexBuilder(args.index_dir, passage_words=args.passage_words).update(args.snapshot_dir)
+    print(
+        f"Indexed {stats['passages']} passages in {time.time() - start_time:.1f}s "
+        f"(added {stats['added']}, updated {stats['updated']}, removed {stats['removed']}, "
+        f"unchanged {stats['unchanged']} files)"
+    )
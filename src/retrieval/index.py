@@ -0,0 +1,323 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import struct
+import time
+from array import array
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.config import get_settings
+from src.retrieval.text import analyze, detect_language, extract_main_text, split_passages
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+SNAPSHOT_EXTENSIONS = (".html", ".htm", ".txt")
+# One posting: passage id (uint32) and term frequency (uint16)
+POSTING = struct.Struct("<IH")
+LANGUAGE_CODES = {None: 0, "en": 1, "ru": 2}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def _url_for(relpath: str, page: Dict) -> str:
+    """Pages are stored as <host>/<path>.html, unless they declare a canonical URL."""
+    if page.get("canonical_url"):
+        return page["canonical_url"]
+    path = relpath.replace(os.sep, "/")
+    for suffix in SNAPSHOT_EXTENSIONS:
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+    if path.endswith("/index") or path == "index":
+        path = path[:-len("index")]
+    return f"https://{path}"
+
+
+def _read_page(path: str) -> Dict:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        content = f.read()
+    if path.endswith(".txt"):
+        # Plain text pages may start with a "URL: ..." line
+        first_line, _, rest = content.partition("\n")
+        if first_line.startswith("URL:"):
+            return {"title": "", "text": rest, "canonical_url": first_line[4:].strip()}
+        return {"title": "", "text": content, "canonical_url": None}
+    return extract_main_text(content)
+
+
+class IndexBuilder:
+    """
+    Builds the on-disk index from a directory snapshot of itmo.ru pages.
+
+    Updates are incremental: only new or modified files are parsed and
+    stemmed (their analyzed passages are kept in forward.json), removed files
+    are dropped, and then a new generation of the posting files is written
+    and published by atomically replacing the CURRENT pointer.
+    """
+
+    def __init__(self, index_dir: str, passage_words: int = 120):
+        self.index_dir = index_dir
+        self.passage_words = passage_words
+        self.forward_path = os.path.join(index_dir, "forward.json")
+
+    def _load_forward(self) -> Dict:
+        if not os.path.exists(self.forward_path):
+            return {}
+        with open(self.forward_path, encoding="utf-8") as f:
+            forward = json.load(f)
+        return forward if forward.get("version") == INDEX_VERSION else {}
+
+    def _scan(self, snapshot_dir: str) -> Iterator[Tuple[str, str]]:
+        for root, _, files in os.walk(snapshot_dir):
+            for name in files:
+                if name.endswith(SNAPSHOT_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, snapshot_dir), path
+
+    def _analyze_file(self, relpath: str, path: str) -> List[Dict]:
+        page = _read_page(path)
+        url = _url_for(relpath, page)
+        passages = []
+        for text in split_passages(page["text"], self.passage_words):
+            language = detect_language(text)
+            passages.append({
+                "url": url,
+                "title": page["title"],
+                "text": text,
+                # Mixed and other-script passages match queries in either language
+                "lang": language if language in LANGUAGE_CODES else None,
+                "terms": Counter(analyze(f"{page['title']} {text}")),
+            })
+        return passages
+
+    def update(self, snapshot_dir: str) -> Dict[str, int]:
+        os.makedirs(self.index_dir, exist_ok=True)
+        forward = self._load_forward()
+        files = forward.get("files", {})
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        seen = set()
+        for relpath, path in self._scan(snapshot_dir):
+            seen.add(relpath)
+            info = os.stat(path)
+            signature = [info.st_mtime_ns, info.st_size]
+            previous = files.get(relpath)
+            if previous is not None and previous["signature"] == signature:
+                stats["unchanged"] += 1
+                continue
+            stats["updated" if previous is not None else "added"] += 1
+            files[relpath] = {"signature": signature, "passages": self._analyze_file(relpath, path)}
+
+        for relpath in list(files):
+            if relpath not in seen:
+                del files[relpath]
+                stats["removed"] += 1
+
+        with open(self.forward_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": files}, f, ensure_ascii=False)
+        os.replace(self.forward_path + ".tmp", self.forward_path)
+
+        stats["passages"] = self._write_generation(files)
+        return stats
+
+    def _write_generation(self, files: Dict) -> int:
+        generation = f"gen-{time.time_ns()}"
+        directory = os.path.join(self.index_dir, generation)
+        os.makedirs(directory)
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = array("I")
+        languages = bytearray()
+        offsets = array("Q", [0])
+
+        with open(os.path.join(directory, "docs.jsonl"), "wb") as docs:
+            doc_id = 0
+            for relpath in sorted(files):
+                for passage in files[relpath]["passages"]:
+                    line = json.dumps(
+                        {"url": passage["url"], "title": passage["title"], "text": passage["text"]},
+                        ensure_ascii=False,
+                    ).encode("utf-8") + b"\n"
+                    docs.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                    lengths.append(sum(passage["terms"].values()))
+                    languages.append(LANGUAGE_CODES.get(passage["lang"], 0))
+                    for term, tf in passage["terms"].items():
+                        postings.setdefault(term, []).append((doc_id, min(tf, 0xFFFF)))
+                    doc_id += 1
+
+        lexicon = {}
+        with open(os.path.join(directory, "postings.bin"), "wb") as f:
+            position = 0
+            for term in sorted(postings):
+                entries = postings[term]
+                f.write(b"".join(POSTING.pack(doc, tf) for doc, tf in entries))
+                lexicon[term] = [position, len(entries)]
+                position += len(entries)
+
+        with open(os.path.join(directory, "lexicon.json"), "w", encoding="utf-8") as f:
+            json.dump(lexicon, f, ensure_ascii=False)
+        with open(os.path.join(directory, "doc_offsets.bin"), "wb") as f:
+            offsets.tofile(f)
+        with open(os.path.join(directory, "doc_lengths.bin"), "wb") as f:
+            lengths.tofile(f)
+        with open(os.path.join(directory, "doc_languages.bin"), "wb") as f:
+            f.write(bytes(languages))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "documents": len(lengths)}, f)
+
+        current = os.path.join(self.index_dir, "CURRENT")
+        previous = _read_current(self.index_dir)
+        with open(current + ".tmp", "w") as f:
+            f.write(generation)
+        os.replace(current + ".tmp", current)
+
+        # Keep the previous generation for readers that still have it open
+        for name in os.listdir(self.index_dir):
+            if name.startswith("gen-") and name not in (generation, previous):
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+        return len(lengths)
+
+
+def _read_current(index_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_dir, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class LocalIndex:
+    """Read-only view of one index generation; postings and passages are memory-mapped."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.generation = _read_current(index_dir)
+        if self.generation is None:
+            raise FileNotFoundError(f"No index found in {index_dir}")
+        directory = os.path.join(index_dir, self.generation)
+
+        with open(os.path.join(directory, "lexicon.json"), encoding="utf-8") as f:
+            self.lexicon: Dict[str, List[int]] = json.load(f)
+        self.offsets = array("Q")
+        with open(os.path.join(directory, "doc_offsets.bin"), "rb") as f:
+            self.offsets.frombytes(f.read())
+        self.lengths = array("I")
+        with open(os.path.join(directory, "doc_lengths.bin"), "rb") as f:
+            self.lengths.frombytes(f.read())
+        with open(os.path.join(directory, "doc_languages.bin"), "rb") as f:
+            self.languages = f.read()
+
+        self.documents = len(self.lengths)
+        self.avg_length = (sum(self.lengths) / self.documents) if self.documents else 1.0
+        self._postings = self._map(os.path.join(directory, "postings.bin"))
+        self._docs = self._map(os.path.join(directory, "docs.jsonl"))
+
+    @staticmethod
+    def _map(path: str) -> Optional[mmap.mmap]:
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def passage(self, doc_id: int) -> Dict:
+        return json.loads(self._docs[self.offsets[doc_id]:self.offsets[doc_id + 1]])
+
+    def search(self, query: str, k: int = 5, language: Optional[str] = None) -> List[Dict]:
+        """
+        Return the top k passages for query by BM25, best first.
+
+        When language is given, passages detected as the other language are
+        skipped. Every result has title, link, snippet and score.
+        """
+        if not self.documents or self._postings is None:
+            return []
+
+        language_code = LANGUAGE_CODES.get(language, 0)
+        scores: Dict[int, float] = {}
+        for term in set(analyze(query)):
+            entry = self.lexicon.get(term)
+            if entry is None:
+                continue
+            position, count = entry
+            idf = math.log(1 + (self.documents - count + 0.5) / (count + 0.5))
+            start = position * POSTING.size
+            for doc_id, tf in POSTING.iter_unpack(self._postings[start:start + count * POSTING.size]):
+                if language_code and self.languages[doc_id] not in (0, language_code):
+                    continue
+                norm = K1 * (1 - B + B * self.lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        results = []
+        for doc_id, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            passage = self.passage(doc_id)
+            results.append({
+                "title": passage["title"],
+                "link": passage["url"],
+                "snippet": passage["text"],
+                "score": round(score, 3),
+            })
+        return results
+
+
+_local_index: Optional[LocalIndex] = None
+_local_index_checked_at = 0.0
+
+
+def get_local_index() -> Optional[LocalIndex]:
+    """
+    Return the worker's view of the local index, or None when there is none.
+
+    The CURRENT pointer is re-checked at most every LOCAL_INDEX_RELOAD_INTERVAL
+    seconds so a re-indexed snapshot is picked up without a restart.
+    """
+    global _local_index, _local_index_checked_at
+    settings = get_settings()
+    if not settings.LOCAL_INDEX_ENABLED:
+        return None
+
+    now = time.monotonic()
+    if _local_index is not None and now - _local_index_checked_at < settings.LOCAL_INDEX_RELOAD_INTERVAL:
+        return _local_index
+    _local_index_checked_at = now
+
+    generation = _read_current(settings.LOCAL_INDEX_PATH)
+    if generation is None:
+        _local_index = None
+    elif _local_index is None or _local_index.generation != generation:
+        try:
+            _local_index = LocalIndex(settings.LOCAL_INDEX_PATH)
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to open local index: %s", e)
+            _local_index = None
+    return _local_index
+
+
+def search_local_index(query: str, language: Optional[str] = None) -> Optional[List[Dict]]:
+    """
+    Answer a search from the local index when it is confident.
+
+    Returns the top passages when the best score reaches LOCAL_INDEX_MIN_SCORE,
+    otherwise None so the caller falls back to Google.
+    """
+    index = get_local_index()
+    if index is None:
+        return None
+    settings = get_settings()
+    results = index.search(query, k=settings.LOCAL_INDEX_TOP_K, language=language)
+    if not results or results[0]["score"] < settings.LOCAL_INDEX_MIN_SCORE:
+        return None
+    return results
+
+
+async def asearch_local_index(query: str, language: Optional[str] = None) -> Optional[List[Dict]]:
+    """search_local_index off the event loop, as opening a new index generation reads it from disk."""
+    return await asyncio.to_thread(search_local_index, query, language)
@@ -0,0 +1,128 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+import snowballstemmer
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-яё]")
+_LATIN_RE = re.compile(r"[a-z]")
+_LETTER_RE = re.compile(r"[^\W\d_]", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+# Elements that never hold the main text of a page
+_SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "nav", "header", "footer", "aside", "form"}
+_BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th",
+    "h1", "h2", "h3", "h4", "h5", "h6", "br", "blockquote", "pre", "dd", "dt",
+}
+
+# Share of letters that must come from one script to call the language
+SCRIPT_CONFIDENCE = 0.8
+
+_russian_stemmer = snowballstemmer.stemmer("russian")
+_english_stemmer = snowballstemmer.stemmer("english")
+
+
+class _MainTextParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.title_parts: List[str] = []
+        self.canonical_url: Optional[str] = None
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag == "link":
+            attributes = dict(attrs)
+            if (attributes.get("rel") or "").lower() == "canonical" and attributes.get("href"):
+                self.canonical_url = attributes["href"]
+        elif tag == "meta":
+            attributes = dict(attrs)
+            if attributes.get("property") == "og:url" and attributes.get("content") and not self.canonical_url:
+                self.canonical_url = attributes["content"]
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == "title":
+            self._in_title = False
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title_parts.append(data)
+        elif not self._skip_depth:
+            self.parts.append(data)
+
+
+def extract_main_text(html: str) -> Dict[str, Optional[str]]:
+    """
+    Extract the readable text of an HTML page.
+
+    Returns title, text (block elements become line breaks, navigation and
+    scripts are dropped) and canonical_url when the page declares one.
+    """
+    parser = _MainTextParser()
+    parser.feed(html)
+    parser.close()
+    text = _WHITESPACE_RE.sub(" ", "".join(parser.parts))
+    text = _BLANK_LINES_RE.sub("\n\n", "\n".join(line.strip() for line in text.splitlines()))
+    return {
+        "title": _WHITESPACE_RE.sub(" ", "".join(parser.title_parts)).strip(),
+        "text": text.strip(),
+        "canonical_url": parser.canonical_url,
+    }
+
+
+def split_passages(text: str, max_words: int = 120, overlap: int = 20) -> List[str]:
+    """Split text into passages of at most max_words words, overlapping by overlap words."""
+    words = text.split()
+    if len(words) <= max_words:
+        return [" ".join(words)] if words else []
+    step = max(1, max_words - overlap)
+    return [" ".join(words[i:i + max_words]) for i in range(0, len(words) - overlap, step)]
+
+
+@lru_cache(maxsize=100_000)
+def stem(token: str) -> str:
+    if _CYRILLIC_RE.search(token):
+        return _russian_stemmer.stemWord(token)
+    return _english_stemmer.stemWord(token)
+
+
+def analyze(text: str) -> List[str]:
+    """Lowercase, tokenize and stem text with the Russian or English stemmer per token."""
+    return [stem(token) for token in _TOKEN_RE.findall(text.lower().replace("ё", "е"))]
+
+
+def detect_language(text: str) -> str:
+    """Return "ru", "en", "other" or "mixed" based on the letters used in text."""
+    text = text.lower()
+    letters = len(_LETTER_RE.findall(text))
+    if letters == 0:
+        return "mixed"
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    latin = len(_LATIN_RE.findall(text))
+    if cyrillic / letters >= SCRIPT_CONFIDENCE:
+        return "ru"
+    if latin / letters >= SCRIPT_CONFIDENCE:
+        return "en"
+    if (cyrillic + latin) / letters < 1 - SCRIPT_CONFIDENCE:
+        return "other"
+    return "mixed"
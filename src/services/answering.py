@@ -0,0 +1,71 @@
+from typing import Awaitable, Callable, Dict, Tuple
+
+from pydantic import HttpUrl
+
+from src.cache.answer_cache import get_answer_cache
+from src.cache.faq_store import alookup_faq
+from src.config import get_settings
+from src.services.google_mistral_service import GoogleMistralService
+from utils.singleflight import SingleFlight
+
+inflight = SingleFlight("answer")
+
+
+async def answer_with_cache(
+    namespace: str, query: str, compute: Callable[[], Awaitable[Tuple[Dict, bool]]]
+) -> Dict:
+    """
+    Return the answer payload (answer/reasoning/sources) for a query, serving
+    it from the FAQ store or the answer cache when possible.
+
+    compute runs the full pipeline and returns the payload together with a
+    flag telling whether it may be cached (errors reported by the agent are
+    returned to the client but never cached). Concurrent requests with the
+    same canonical query share a single compute call.
+    """
+    settings = get_settings()
+    answer_cache = get_answer_cache(namespace)
+
+    payload = await alookup_faq(query)
+    if payload is not None:
+        return payload
+
+    if settings.ANSWER_CACHE_ENABLED:
+        payload = await answer_cache.aget(query)
+        if payload is not None:
+            return payload
+
+    async def run():
+        payload, cacheable = await compute()
+        if cacheable and settings.ANSWER_CACHE_ENABLED:
+            await answer_cache.aset(query, payload)
+        return query, payload
+
+    if not settings.REQUEST_COALESCING_ENABLED:
+        _, payload = await run()
+        return payload
+
+    origin_query, payload = await inflight.do(answer_cache.key_for(query), run)
+    if origin_query == query:
+        return payload
+
+    # The shared run may have listed the options in a different order
+    remapped = answer_cache.remap(origin_query, query, payload)
+    if remapped is None:
+        _, remapped = await run()
+    return remapped
+
+
+async def answer_with_google_mistral(
+    service: GoogleMistralService, query: str, request_id: str
+) -> Dict:
+    """Answer payload for /api/request, shared by the endpoint and batch processing."""
+    async def compute():
+        result = await service.process_request(query, request_id)
+        return {
+            "answer": result["answer"],
+            "reasoning": result["reasoning"],
+            "sources": [str(HttpUrl(url)) for url in result["sources"][:3]],
+        }, not (result.get("partial", False) or result.get("error", False))
+
+    return await answer_with_cache("request", query, compute)
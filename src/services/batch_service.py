@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from schemas.request import PredictionRequest
+from src.cache.answer_cache import get_answer_cache
+from src.config import get_settings
+from src.services.answering import answer_with_google_mistral
+from src.services.google_mistral_service import GoogleMistralService
+from src.services.upstream import UpstreamUnavailable
+from utils.admission import AdmissionController, Overloaded
+from utils.deadline import DeadlineExceeded, deadline_scope
+
+logger = logging.getLogger(__name__)
+
+
+async def run_batch(
+    service: GoogleMistralService,
+    items: Iterable[PredictionRequest],
+    concurrency: int,
+    admission: Optional[AdmissionController] = None,
+    priority: int = 1,
+) -> AsyncIterator[Dict]:
+    """
+    Answer a batch of requests with at most `concurrency` pipelines in flight.
+
+    With an admission controller, every pipeline also waits for one of its
+    slots at the given priority, without a time limit.
+
+    Items whose queries share a canonical form are answered once. Results are
+    yielded in completion order, one dict per item: the response fields, or
+    id/error/status when the item failed.
+    """
+    answer_cache = get_answer_cache("request")
+    settings = get_settings()
+
+    groups: Dict[str, List[PredictionRequest]] = {}
+    for item in items:
+        groups.setdefault(answer_cache.key_for(item.query), []).append(item)
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_group(group: List[PredictionRequest]) -> List[Dict]:
+        leader = group[0]
+        async with semaphore:
+            try:
+                slot = admission.slot(priority, "batch") if admission is not None else nullcontext()
+                # The deadline starts once the item leaves the queue
+                async with slot:
+                    with deadline_scope(settings.REQUEST_DEADLINE):
+                        payload = await answer_with_google_mistral(service, leader.query, str(leader.id))
+            except DeadlineExceeded as e:
+                return [{"id": item.id, "error": str(e), "status": 504} for item in group]
+            except (UpstreamUnavailable, Overloaded) as e:
+                return [{"id": item.id, "error": str(e), "status": 503} for item in group]
+            except ValueError as e:
+                return [{"id": item.id, "error": str(e), "status": 400} for item in group]
+            except Exception as e:
+                logger.warning("Batch item %s failed: %s", leader.id, e)
+                return [{"id": item.id, "error": "Internal server error", "status": 500} for item in group]
+
+        results = []
+        for item in group:
+            item_payload = payload
+            if item.query != leader.query:
+                item_payload = answer_cache.remap(leader.query, item.query, payload)
+                if item_payload is None:
+                    # Same question, but the chosen option is missing from this variant
+                    item_payload = {**payload, "answer": None}
+            results.append({"id": item.id, **item_payload})
+        return results
+
+    tasks = [asyncio.ensure_future(answer_group(group)) for group in groups.values()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,158 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils.tokens import estimate_tokens
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_TRACKING_PARAMS = ("utm_", "gclid", "fbclid", "yclid", "_openstat")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# A result cut to fit the budget keeps at least this many tokens of snippet,
+# otherwise it is skipped (the top-ranked result is always kept)
+MIN_TRUNCATED_SNIPPET_TOKENS = 50
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so the same page found by different searches compares equal."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PARAMS)
+    ))
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def is_itmo_domain(url: str) -> bool:
+    host = (urlsplit(url).hostname or "").lower()
+    return host == "itmo.ru" or host.endswith(".itmo.ru")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def format_result(result: Dict) -> str:
+    return f"Source: {result['link']}\nTitle: {result['title']}\nSnippet: {result['snippet']}"
+
+
+def truncate_result(result: Dict, token_budget: int) -> Dict:
+    """Cut the snippet of result, at a word boundary, so the formatted result fits token_budget."""
+    max_chars = (token_budget - 1) * 4 - len(format_result({**result, "snippet": ""}))
+    snippet = result["snippet"]
+    if len(snippet) <= max_chars:
+        return result
+    snippet = snippet[:max(0, max_chars - 2)]
+    if " " in snippet:
+        snippet = snippet.rsplit(" ", 1)[0]
+    return {**result, "snippet": f"{snippet} …" if snippet else ""}
+
+
+def bm25_scores(question: str, documents: List[str]) -> List[float]:
+    """Score documents against the question with BM25, using the documents themselves as the corpus."""
+    query_terms = set(tokenize(question))
+    tokenized = [tokenize(document) for document in documents]
+    if not tokenized or not query_terms:
+        return [0.0] * len(documents)
+
+    avg_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1.0
+    document_frequency = Counter(term for tokens in tokenized for term in set(tokens) & query_terms)
+    total = len(tokenized)
+
+    scores = []
+    for tokens in tokenized:
+        frequencies = Counter(tokens)
+        score = 0.0
+        for term in query_terms:
+            tf = frequencies.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (total - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * len(tokens) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def rank_results(question: str, results: List[Dict], itmo_boost: float = 1.0) -> List[Dict]:
+    """
+    Merge results pointing at the same canonical URL (keeping their distinct
+    snippets) and order them by BM25 against the question, with a bonus for
+    itmo.ru pages.
+    """
+    merged: Dict[str, Dict] = {}
+    for result in results:
+        link = result.get("link")
+        if not link:
+            continue
+        key = canonical_url(link)
+        if key not in merged:
+            merged[key] = {"title": result.get("title", ""), "link": link, "snippet": result.get("snippet", "")}
+        elif result.get("snippet") and result["snippet"] not in merged[key]["snippet"]:
+            merged[key]["snippet"] = f"{merged[key]['snippet']} … {result['snippet']}"
+
+    candidates = list(merged.values())
+    scores = bm25_scores(question, [f"{c['title']} {c['snippet']}" for c in candidates])
+    ranked = sorted(
+        zip(candidates, scores),
+        key=lambda item: item[1] + (itmo_boost if is_itmo_domain(item[0]["link"]) else 0.0),
+        reverse=True,
+    )
+    return [candidate for candidate, _ in ranked]
+
+
+def pack_context(
+    question: str,
+    results: List[Dict],
+    token_budget: int,
+    itmo_boost: float = 1.0,
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Build the search context for the answer prompt.
+
+    Results are merged and ranked by rank_results, and the best ones are
+    packed until the token budget is spent. The first result that does not
+    fit is cut to the budget left rather than skipped, so the top-ranked
+    result is always in the context however long its snippet is.
+
+    Returns:
+        Tuple of the packed results (best first) and stats with the token
+        counts before and after packing
+    """
+    ranked = rank_results(question, results, itmo_boost)
+
+    packed, packed_tokens = [], 0
+    for candidate in ranked:
+        tokens = estimate_tokens(format_result(candidate))
+        if packed_tokens + tokens > token_budget:
+            remaining = token_budget - packed_tokens
+            overhead = estimate_tokens(format_result({**candidate, "snippet": ""}))
+            if packed and remaining - overhead < MIN_TRUNCATED_SNIPPET_TOKENS:
+                # Too little room left for a useful cut, a shorter result may still fit
+                continue
+            candidate = truncate_result(candidate, remaining)
+            tokens = estimate_tokens(format_result(candidate))
+            packed.append(candidate)
+            packed_tokens += tokens
+            break
+        packed.append(candidate)
+        packed_tokens += tokens
+
+    input_tokens = sum(estimate_tokens(format_result(r)) for r in results if r.get("link"))
+    stats = {
+        "results": len(results),
+        "duplicates": len(results) - len(ranked),
+        "packed": len(packed),
+        "input_tokens": input_tokens,
+        "packed_tokens": packed_tokens,
+        "tokens_saved": max(0, input_tokens - packed_tokens),
+    }
+    return packed, stats
@@ -1,8 +1,72 @@
 import os
 import json
-from typing import Dict, List, Optional, Tuple
-from googleapiclient.discovery import build
+import asyncio
+import logging
+import time
+from functools import cached_property, lru_cache
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
 from mistralai import Mistral
+from src.cache.search_cache import get_search_cache
+from src.config import get_settings
+from src.retrieval.index import asearch_local_index
+from src.services.context_packer import pack_context, rank_results
+from src.services.http_transport import GOOGLE_API_ROOT, async_client, sync_client
+from src.services.json_stream import DELTA, FIELD, JSONObjectStreamParser
+from src.services.model_router import get_model_router
+from src.services.page_fetcher import get_page_fetcher
+from src.services.preclassifier import detect_language, preclassify, question_similarity
+from src.services.upstream import UpstreamUnavailable, get_upstream
+from utils.deadline import DeadlineExceeded, LatencyTracker, gather_partial, hedged, run_within, time_left
+from utils.metrics import (
+    CONTEXT_TOKENS_SAVED,
+    PRECLASSIFIER_DECISIONS,
+    SEARCHES,
+    SPECULATIVE_SEARCHES,
+    record_token_usage,
+)
+from utils.timing import stage
+from utils.tracing import span, start_span
+
+logger = logging.getLogger(__name__)
+
+
+def deadline_reasoning(query: str) -> str:
+    """Explanation sent with a partial answer, in the language of the query."""
+    if detect_language(query) == "ru":
+        return "Не удалось сформировать ответ за отведённое время. Возможно, ответ есть в найденных источниках."
+    return "The answer could not be generated in time. The sources found may contain it."
+
+
+def _customsearch_request(params: Dict) -> Tuple[str, Dict]:
+    settings = get_settings()
+    url = (settings.GOOGLE_API_ENDPOINT or GOOGLE_API_ROOT).rstrip("/") + "/customsearch/v1"
+    return url, {"key": settings.GOOGLE_API_KEY, **params}
+
+
+@lru_cache()
+def _google_client():
+    return sync_client(timeout=get_settings().GOOGLE_TIMEOUT)
+
+
+@lru_cache()
+def _google_async_client():
+    return async_client(timeout=get_settings().GOOGLE_TIMEOUT)
+
+
+def customsearch(params: Dict) -> Dict:
+    """Custom Search API list call over the shared connection pools; safe to run from several threads."""
+    url, query = _customsearch_request(params)
+    response = _google_client().get(url, params=query)
+    response.raise_for_status()
+    return response.json()
+
+
+async def acustomsearch(params: Dict) -> Dict:
+    url, query = _customsearch_request(params)
+    response = await _google_async_client().get(url, params=query)
+    response.raise_for_status()
+    return response.json()
+
 
 class GoogleMistralService:
     def __init__(self):
@@ -10,8 +74,31 @@ class GoogleMistralService:
         self.google_cse_id = os.getenv("GOOGLE_CSE_ID")
         self.mistral_api_key = os.getenv("MISTRAL_API_KEY")
         
-        self.google_service = build("customsearch", "v1", developerKey=self.google_api_key)
-        self.mistral_client = Mistral(api_key=self.mistral_api_key)
+        settings = get_settings()
+        self.mistral_server_url = settings.MISTRAL_SERVER_URL
+        self.mistral_timeout = settings.MISTRAL_TIMEOUT
+        # Rate limits, retries and circuit breakers shared with the agent pipeline
+        self.mistral = get_upstream("mistral")
+        self.google = get_upstream("google")
+        self.model_router = get_model_router()
+        self.search_cache = get_search_cache()
+        self.preclassifier_enabled = settings.PRECLASSIFIER_ENABLED
+        self.preclassifier_both_languages = settings.PRECLASSIFIER_SEARCH_BOTH_LANGUAGES
+        self.speculative_search_enabled = settings.SPECULATIVE_SEARCH_ENABLED
+        self.speculation_similarity = settings.SPECULATIVE_SEARCH_SIMILARITY
+        self.context_token_budget = settings.CONTEXT_TOKEN_BUDGET
+        self.context_itmo_boost = settings.CONTEXT_ITMO_BOOST
+        self.page_fetch_enabled = settings.PAGE_FETCH_ENABLED
+        self.page_fetch_top_n = settings.PAGE_FETCH_TOP_N
+        self.page_fetch_deadline = settings.PAGE_FETCH_DEADLINE
+        self.validation_share = settings.DEADLINE_VALIDATION_SHARE
+        self.search_share = settings.DEADLINE_SEARCH_SHARE
+        self.page_fetch_share = settings.DEADLINE_PAGE_FETCH_SHARE
+        self.hedge_enabled = settings.GOOGLE_HEDGE_ENABLED
+        self.hedge_percentile = settings.GOOGLE_HEDGE_PERCENTILE
+        self.hedge_min_delay = settings.GOOGLE_HEDGE_MIN_DELAY
+        self.hedge_default_delay = settings.GOOGLE_HEDGE_DEFAULT_DELAY
+        self.google_latency = LatencyTracker()
 
         # Prompts from the image
         self.validation_prompt = """You are an intelligent assistant providing information about ITMO University.
@@ -28,6 +115,7 @@ Analyze the following query and return a JSON with:
 2. is_ethical (boolean): Is the query ethical and appropriate?
 3. question_ru (string): Extract just the question part in Russian (null if not applicable)
 4. question_en (string): Extract just the question part in English (null if not applicable)
+5. confidence (number from 0 to 1): How sure you are about is_valid and is_ethical
 Do not return any other text or comments. Do not add ```json and other Markdown formatting.
 
 Query: {query}"""
@@ -52,6 +140,12 @@ Search results:
 
 Query: {query}"""
 
+        # Appended to the answer prompt when the LLM validation was skipped
+        self.screening_instructions = """
+
+The query has not been screened yet. If it is not about ITMO University, or it is unethical or inappropriate,
+set answer to null and explain in reasoning that you can only help with appropriate questions about ITMO University."""
+
     async def validate_and_extract_questions(self, query: str) -> Dict:
         messages = [
             {
@@ -60,26 +154,80 @@ Query: {query}"""
             }
         ]
         
+        async def call(model: str) -> Dict:
+            with stage("validation"):
+                response = await self.mistral.call(lambda: self.mistral_client.chat.complete_async(
+                    model=model,
+                    messages=messages
+                ))
+            record_token_usage("validation", response.usage)
+
+            with span("parse_json"):
+                return json.loads(response.choices[0].message.content)
+
         try:
-            response = self.mistral_client.chat.complete(
-                model="mistral-large-latest",
-                messages=messages
-            )
-            
-            return json.loads(response.choices[0].message.content)
+            # A small model first, the large one when it cannot decide
+            return await self.model_router.run("validation", call, self._confident_validation)
         except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {str(e)}")
+            logger.warning("JSON parsing error in validation: %s", e)
             return {
                 "is_valid": False,
                 "is_ethical": False,
                 "question_ru": None,
                 "question_en": None
             }
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            print(f"Unexpected error in validate_and_extract_questions: {str(e)}")
+            logger.exception("Unexpected error in validate_and_extract_questions: %s", e)
             raise
 
+    # The client is created on first use, so a service built before the workers
+    # fork (gunicorn --preload) does not share connections between them
+    @cached_property
+    def mistral_client(self) -> Mistral:
+        return Mistral(
+            api_key=self.mistral_api_key,
+            server_url=self.mistral_server_url,
+            client=sync_client(),
+            async_client=async_client(),
+            timeout_ms=int(self.mistral_timeout * 1000),
+        )
+
+    def _confident_validation(self, result: Dict) -> bool:
+        if not isinstance(result.get("is_valid"), bool) or not isinstance(result.get("is_ethical"), bool):
+            return False
+        if result["is_valid"] and not (result.get("question_ru") or result.get("question_en")):
+            return False
+        return self.model_router.confident(result)
+
+    async def _timed_search(self, params: Dict) -> Dict:
+        start_time = time.perf_counter()
+        results = await self.google.call(lambda: acustomsearch(params))
+        self.google_latency.record(time.perf_counter() - start_time)
+        return results
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        delay = self.google_latency.percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, delay if delay is not None else self.hedge_default_delay)
+
     async def search_google(self, query: str, language: str = "en") -> List[Dict]:
+        # The local itmo.ru index answers most questions without a Google call
+        with stage(f"local_search_{language}"):
+            local_results = await asearch_local_index(query, language)
+        if local_results is not None:
+            SEARCHES.labels("local_index").inc()
+            return local_results
+
+        cached = await self.search_cache.aget(query, language)
+        if cached is not None:
+            SEARCHES.labels("cache").inc()
+            return cached
+
+        SEARCHES.labels("google").inc()
+
         try:
             # Add language specific parameters
             params = {
@@ -89,75 +237,266 @@ Query: {query}"""
                 "num": 5
             }
             
-            results = self.google_service.cse().list(**params).execute()
+            # A slow call is hedged with a second one, whichever answers first wins
+            with stage(f"search_{language}"):
+                results = await hedged("google", lambda: self._timed_search(params), self._hedge_delay())
             
-            if "items" not in results:
-                return []
-                
-            return [{"title": item["title"], "link": item["link"], "snippet": item["snippet"]} 
-                   for item in results["items"]]
-                   
+            items = [{"title": item["title"], "link": item["link"], "snippet": item["snippet"]}
+                     for item in results.get("items", [])]
+            await self.search_cache.aset(query, items, language)
+            return items
+
+        except UpstreamUnavailable:
+            # An outage fails the request instead of answering without sources
+            raise
         except Exception as e:
-            print(f"Google search error: {str(e)}")
+            logger.warning("Google search error: %s", e)
             return []
 
-    async def get_final_answer(self, query: str, search_results: List[Dict]) -> Dict:
+    def _answer_messages(self, query: str, search_results: List[Dict], screened: bool = True) -> List[Dict]:
         # Format search results for the prompt
         formatted_results = "\n\n".join([
             f"Source: {result['link']}\nTitle: {result['title']}\nSnippet: {result['snippet']}"
             for result in search_results
         ])
-        
-        messages = [
+
+        return [
             {
-                "role": "user", 
+                "role": "user",
                 "content": self.answer_prompt.format(
                     search_results=formatted_results,
                     query=query
-                )
+                ) + ("" if screened else self.screening_instructions)
             }
         ]
-        
+
+    async def get_final_answer(self, query: str, search_results: List[Dict], screened: bool = True) -> Dict:
+        messages = self._answer_messages(query, search_results, screened)
+
+        async def call(model: str) -> Dict:
+            with stage("answer"):
+                response = await self.mistral.call(lambda: self.mistral_client.chat.complete_async(
+                    model=model,
+                    messages=messages
+                ))
+            record_token_usage("answer", response.usage)
+
+            with span("parse_json"):
+                return json.loads(response.choices[0].message.content)
+
         try:
-            response = self.mistral_client.chat.complete(
-                model="mistral-large-latest",
-                messages=messages
-            )
-            
-            return json.loads(response.choices[0].message.content)
+            return await self.model_router.run("answer", call)
         except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {str(e)}")
+            logger.warning("JSON parsing error in final answer: %s", e)
+            # Returned to the client but never cached
             return {
                 "answer": None,
                 "reasoning": "Error processing the response",
-                "sources": []
+                "sources": [],
+                "error": True,
             }
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            print(f"Unexpected error in get_final_answer: {str(e)}")
+            logger.exception("Unexpected error in get_final_answer: %s", e)
             raise
 
-    async def process_request(self, query: str, request_id: str) -> Dict:
-        # First, validate and extract questions
-        validation_result = await self.validate_and_extract_questions(query)
-        
-        if not validation_result["is_valid"]:
-            raise ValueError("Query is not related to ITMO University")
-            
-        if not validation_result["is_ethical"]:
-            raise ValueError("Query is not ethical or appropriate")
-            
-        # Search in both languages if available
-        search_results = []
-        if validation_result["question_en"]:
-            en_results = await self.search_google(validation_result["question_en"], "en")
-            search_results.extend(en_results)
-            
-        if validation_result["question_ru"]:
-            ru_results = await self.search_google(validation_result["question_ru"], "ru")
-            search_results.extend(ru_results)
-            
+    async def stream_final_answer(
+        self, query: str, search_results: List[Dict], screened: bool = True
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Stream the final answer as it is generated.
+
+        Yields ("answer", value) once the answer field is complete,
+        ("reasoning", text) for every decoded piece of the reasoning and
+        ("sources", list) once the sources are complete, and finally
+        ("complete", None) when the JSON object was closed. Closing the
+        generator closes the upstream response, which stops the generation.
+        """
+        messages = self._answer_messages(query, search_results, screened)
+        parser = JSONObjectStreamParser()
+        # The generator is resumed by the response, so its span is not made current
+        answer_span = start_span("answer_stream")
+        chunks = 0
+
+        try:
+            # Only opening the stream is retried, a broken stream is not resumed
+            stream = await self.mistral.call(lambda: self.mistral_client.chat.stream_async(
+                model=self.model_router.model_for("answer"),
+                messages=messages
+            ))
+            async with stream:
+                async for event in stream:
+                    if event.data.usage is not None:
+                        record_token_usage("answer", event.data.usage)
+                    if not event.data.choices:
+                        continue
+                    content = event.data.choices[0].delta.content
+                    if not isinstance(content, str):
+                        continue
+                    chunks += 1
+                    if chunks == 1 and answer_span is not None:
+                        answer_span.attrs["first_chunk_ms"] = round(
+                            (time.perf_counter() - answer_span.start) * 1000, 2
+                        )
+
+                    for kind, key, value in parser.feed(content):
+                        if kind == DELTA and key == "reasoning":
+                            yield "reasoning", value
+                        elif kind == FIELD and key in ("answer", "sources"):
+                            yield key, value
+
+                    if parser.done:
+                        yield "complete", None
+                        break
+        finally:
+            if answer_span is not None:
+                answer_span.finish(chunks=chunks, completed=parser.done)
+
+    async def classify(self, query: str, local_result: Dict) -> Dict:
+        """
+        Validate the query and extract its question, locally when the
+        pre-classifier is confident and with the LLM otherwise.
+        """
+        if self.preclassifier_enabled:
+            if local_result["confident"]:
+                PRECLASSIFIER_DECISIONS.labels("fast_path").inc()
+                result = {**local_result, "screened": False}
+                if self.preclassifier_both_languages:
+                    # No translation without the LLM: the other language's search gets the question as is
+                    result["question_ru"] = result["question_ru"] or local_result["question"]
+                    result["question_en"] = result["question_en"] or local_result["question"]
+                return result
+            PRECLASSIFIER_DECISIONS.labels("llm_fallback").inc()
+
+        return {**await self.validate_and_extract_questions(query), "screened": True}
+
+    def _start_speculative_search(self, local_result: Dict) -> Dict[str, Tuple[str, asyncio.Task]]:
+        """Start searching on the locally extracted question while the LLM validates the query."""
+        question = local_result["question"]
+        if not question:
+            return {}
+        languages = [local_result["language"]] if local_result["language"] in ("en", "ru") else ["en", "ru"]
+        return {
+            language: (question, asyncio.ensure_future(self.search_google(question, language)))
+            for language in languages
+        }
+
+    def _discard_speculative_search(self, speculative: Dict[str, Tuple[str, asyncio.Task]]) -> None:
+        for _, task in speculative.values():
+            task.cancel()
+            if task.done() and not task.cancelled():
+                task.exception()  # Failed before it was needed, the error is not reported
+            SPECULATIVE_SEARCHES.labels("discarded").inc()
+        speculative.clear()
+
+    def _search_question(
+        self, question: str, language: str, speculative: Dict[str, Tuple[str, asyncio.Task]]
+    ) -> Awaitable[List[Dict]]:
+        if language not in speculative:
+            return self.search_google(question, language)
+
+        speculative_question, task = speculative.pop(language)
+        if question_similarity(question, speculative_question) >= self.speculation_similarity:
+            SPECULATIVE_SEARCHES.labels("used").inc()
+            return task
+
+        # The extracted question differs too much, keep what was found and top it up
+        SPECULATIVE_SEARCHES.labels("topped_up").inc()
+        return self._top_up_search(task, question, language)
+
+    async def _top_up_search(self, task: asyncio.Task, question: str, language: str) -> List[Dict]:
+        speculative_results, results = await asyncio.gather(task, self.search_google(question, language))
+        return speculative_results + results
+
+    async def gather_context(self, query: str) -> Dict:
+        """
+        Validate the query and collect search results for the answer prompt.
+
+        Returns the deduplicated, ranked and budget-packed search_results
+        and screened, which is False when the LLM validation was skipped and
+        the answer prompt has to screen the query.
+        While the LLM validation runs, a speculative search on the locally
+        extracted question is already in flight; it is cancelled if the query
+        is rejected.
+        """
+        local_result = preclassify(query)
+        speculative = {}
+        if self.speculative_search_enabled and not (self.preclassifier_enabled and local_result["confident"]):
+            speculative = self._start_speculative_search(local_result)
+
+        try:
+            # First, validate and extract questions
+            validation_result = await run_within(
+                self.classify(query, local_result), "validation", self.validation_share
+            )
+
+            if not validation_result["is_valid"]:
+                raise ValueError("Query is not related to ITMO University")
+
+            if not validation_result["is_ethical"]:
+                raise ValueError("Query is not ethical or appropriate")
+
+            # Search in both languages concurrently if available
+            searches = []
+            if validation_result["question_en"]:
+                searches.append(self._search_question(validation_result["question_en"], "en", speculative))
+
+            if validation_result["question_ru"]:
+                searches.append(self._search_question(validation_result["question_ru"], "ru", speculative))
+
+            # Speculative searches in a language the validation did not ask for are not needed
+            self._discard_speculative_search(speculative)
+
+            # Searches still running when their share of the deadline is used up are dropped
+            search_results = []
+            for results in await gather_partial(searches, "search", self.search_share):
+                search_results.extend(results or [])
+        finally:
+            self._discard_speculative_search(speculative)
+
+        question = " ".join(
+            dict.fromkeys(q for q in (validation_result["question_en"], validation_result["question_ru"]) if q)
+        )
+        if self.page_fetch_enabled:
+            with stage("page_fetch"):
+                search_results = await get_page_fetcher().enrich(
+                    question,
+                    rank_results(question, search_results, self.context_itmo_boost),
+                    self.page_fetch_top_n,
+                    time_left(self.page_fetch_share, cap=self.page_fetch_deadline),
+                )
+
+        with stage("context"):
+            search_results, context_stats = pack_context(
+                question, search_results, self.context_token_budget, self.context_itmo_boost
+            )
+        CONTEXT_TOKENS_SAVED.labels("google_mistral").observe(context_stats["tokens_saved"])
+        # Checked after packing: the answer must never be generated from an empty context
         if not search_results:
             raise ValueError("No relevant information found")
-            
-        # Get final answer
-        return await self.get_final_answer(query, search_results) 
\ No newline at end of file
+
+        return {
+            "search_results": search_results,
+            "screened": validation_result["screened"],
+        }
+
+    def partial_answer(self, query: str, search_results: List[Dict]) -> Dict:
+        """Answer returned when the deadline runs out before the LLM has answered: the best sources found."""
+        return {
+            "answer": None,
+            "reasoning": deadline_reasoning(query),
+            "sources": [result["link"] for result in search_results[:3]],
+            "partial": True,
+        }
+
+    async def process_request(self, query: str, request_id: str) -> Dict:
+        context = await self.gather_context(query)
+
+        # Get final answer with whatever is left of the deadline
+        try:
+            return await run_within(
+                self.get_final_answer(query, context["search_results"], context["screened"]), "answer"
+            )
+        except DeadlineExceeded:
+            return self.partial_answer(query, context["search_results"])
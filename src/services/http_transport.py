@@ -0,0 +1,400 @@
+"""
+Per-worker HTTP transport shared by every outgoing call.
+
+Mistral (SDK and langchain), Google Custom Search and the page fetcher send
+their requests through the same connection pools instead of each building its
+own client, so a request reuses a warm connection instead of paying TCP and
+TLS handshakes to the same hosts again:
+- one keep-alive pool each for Mistral and Google, at most
+  HTTP_MAX_CONNECTIONS_PER_HOST connections each, and one pool shared by all
+  fetched pages, at most HTTP_MAX_PAGE_CONNECTIONS connections, so the number
+  of pools does not grow with the hosts the fetcher visits,
+- HTTP/2 where the server negotiates it, so concurrent requests share one
+  connection,
+- host names resolved at most once per DNS_CACHE_TTL, each resolved address
+  tried in turn when connecting,
+- one TLS context per worker, so CA certificates are loaded once.
+Python's ssl module offers no session resumption through httpcore, so TLS
+handshakes are saved by keeping connections alive rather than by resuming
+sessions.
+
+Callers get thin httpx clients (their own base URL, headers and timeout) over
+the shared transport. Closing such a client leaves the pools open; they are
+closed once, by close_http_transport on shutdown. Every request is counted as
+made on a new or a reused connection.
+"""
+import asyncio
+import contextlib
+import ipaddress
+import socket
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpcore
+import httpx
+
+from src.config import get_settings
+from utils.metrics import CACHE_LOOKUPS, HTTP_CONNECTIONS_OPENED, HTTP_REQUESTS
+
+MISTRAL_API_ROOT = "https://api.mistral.ai"
+GOOGLE_API_ROOT = "https://customsearch.googleapis.com/"
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class DNSCache:
+    """Resolved addresses by (host, port), in resolver order, kept for ttl seconds."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host: str, port: int) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is not None and entry[0] > time.monotonic():
+            CACHE_LOOKUPS.labels("dns", "hit").inc()
+            return entry[1]
+        CACHE_LOOKUPS.labels("dns", "miss").inc()
+        return None
+
+    def _set(self, host: str, port: int, infos) -> List[str]:
+        # getaddrinfo lists an address once per socket type and protocol
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int) -> None:
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def resolve(self, host: str, port: int) -> List[str]:
+        if _is_ip(host):
+            return [host]
+        addresses = self._get(host, port)
+        if addresses is None:
+            addresses = self._set(host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        return addresses
+
+    async def aresolve(self, host: str, port: int) -> List[str]:
+        if _is_ip(host):
+            return [host]
+        addresses = self._get(host, port)
+        if addresses is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = self._set(host, port, infos)
+        return addresses
+
+
+class CachingAsyncBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend connecting to cached addresses. Each address is
+    tried in turn, so an unreachable IPv6 address falls back to IPv4. TLS still
+    verifies the original host name, which httpcore passes to start_tls.
+    """
+
+    def __init__(self, dns: DNSCache):
+        self.dns = dns
+        self.backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host: str, port: int, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await self.dns.aresolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        for address in addresses[:-1]:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError:
+                continue
+        try:
+            return await self.backend.connect_tcp(addresses[-1], port, timeout, local_address, socket_options)
+        except httpcore.ConnectError:
+            # The host may have moved, resolve again on the next attempt
+            self.dns.forget(host, port)
+            raise
+
+    async def connect_unix_socket(self, path: str, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self.backend.sleep(seconds)
+
+
+class CachingSyncBackend(httpcore.NetworkBackend):
+    """Synchronous counterpart of CachingAsyncBackend, for calls made from threads."""
+
+    def __init__(self, dns: DNSCache):
+        self.dns = dns
+        self.backend = httpcore.SyncBackend()
+
+    def connect_tcp(self, host: str, port: int, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = self.dns.resolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        for address in addresses[:-1]:
+            try:
+                return self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except httpcore.ConnectError:
+                continue
+        try:
+            return self.backend.connect_tcp(addresses[-1], port, timeout, local_address, socket_options)
+        except httpcore.ConnectError:
+            self.dns.forget(host, port)
+            raise
+
+    def connect_unix_socket(self, path: str, timeout=None, socket_options=None):
+        return self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds: float) -> None:
+        self.backend.sleep(seconds)
+
+
+class _ConnectionTrace:
+    """httpcore trace hook of one request, noting whether it opened a connection."""
+
+    def __init__(self):
+        self.connected = False
+        self.tls = False
+
+    def record(self, event: str) -> None:
+        if event == "connection.connect_tcp.complete":
+            self.connected = True
+        elif event == "connection.start_tls.complete":
+            self.tls = True
+
+    async def atrace(self, event: str, info: Dict[str, Any]) -> None:
+        self.record(event)
+
+    def trace(self, event: str, info: Dict[str, Any]) -> None:
+        self.record(event)
+
+
+@contextlib.contextmanager
+def _map_errors() -> Iterator[None]:
+    """Raise httpcore errors as the httpx errors of the same name, as httpx's own transports do."""
+    try:
+        yield
+    except (
+        httpcore.TimeoutException,
+        httpcore.NetworkError,
+        httpcore.ProtocolError,
+        httpcore.ProxyError,
+        httpcore.UnsupportedProtocol,
+    ) as e:
+        raise getattr(httpx, type(e).__name__)(str(e)) from e
+
+
+def _core_request(request: httpx.Request) -> httpcore.Request:
+    return httpcore.Request(
+        method=request.method,
+        url=httpcore.URL(
+            scheme=request.url.raw_scheme,
+            host=request.url.raw_host,
+            port=request.url.port,
+            target=request.url.raw_path,
+        ),
+        headers=request.headers.raw,
+        content=request.stream,
+        extensions=request.extensions,
+    )
+
+
+class _AsyncResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        with _map_errors():
+            async for chunk in self.stream:
+                yield chunk
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+
+
+class _SyncResponseStream(httpx.SyncByteStream):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self) -> Iterator[bytes]:
+        with _map_errors():
+            for chunk in self.stream:
+                yield chunk
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class HTTPTransport:
+    """
+    The pools of one worker: one per upstream API and one for every fetched
+    page, each built on first use. An httpcore pool serves any number of
+    hosts and drops connections idle for longer than keepalive_expiry, so
+    memory stays bounded however many page hosts are visited.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int,
+        max_page_connections: int,
+        keepalive_expiry: float,
+        http2: bool,
+        dns_ttl: float,
+        upstream_hosts: Dict[str, str],
+    ):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_page_connections = max_page_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.ssl_context = httpx.create_ssl_context()
+        self.dns = DNSCache(dns_ttl)
+        # Pool and metric label per known host, other hosts (fetched pages) share "pages"
+        self.upstream_hosts = upstream_hosts
+        self._async: Dict[str, httpcore.AsyncConnectionPool] = {}
+        self._sync: Dict[str, httpcore.ConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    def _upstream(self, host: str) -> str:
+        return self.upstream_hosts.get(host, "pages")
+
+    def _pool_options(self, upstream: str) -> Dict[str, Any]:
+        max_connections = self.max_page_connections if upstream == "pages" else self.max_connections_per_host
+        return {
+            "ssl_context": self.ssl_context,
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_connections,
+            "keepalive_expiry": self.keepalive_expiry,
+            "http2": self.http2,
+        }
+
+    def async_pool_for(self, request: httpx.Request) -> httpcore.AsyncConnectionPool:
+        upstream = self._upstream(request.url.host)
+        with self._lock:
+            pool = self._async.get(upstream)
+            if pool is None:
+                pool = self._async[upstream] = httpcore.AsyncConnectionPool(
+                    network_backend=CachingAsyncBackend(self.dns), **self._pool_options(upstream)
+                )
+        return pool
+
+    def sync_pool_for(self, request: httpx.Request) -> httpcore.ConnectionPool:
+        upstream = self._upstream(request.url.host)
+        with self._lock:
+            pool = self._sync.get(upstream)
+            if pool is None:
+                pool = self._sync[upstream] = httpcore.ConnectionPool(
+                    network_backend=CachingSyncBackend(self.dns), **self._pool_options(upstream)
+                )
+        return pool
+
+    def record(self, request: httpx.Request, trace: _ConnectionTrace) -> None:
+        upstream = self._upstream(request.url.host)
+        connection = "new" if trace.connected else "reused"
+        HTTP_REQUESTS.labels(upstream, connection).inc()
+        if trace.connected:
+            HTTP_CONNECTIONS_OPENED.labels(upstream, "tls" if trace.tls else "plain").inc()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            async_pools, self._async = list(self._async.values()), {}
+            sync_pools, self._sync = list(self._sync.values()), {}
+        for pool in async_pools:
+            await pool.aclose()
+        for pool in sync_pools:
+            pool.close()
+
+
+class SharedAsyncTransport(httpx.AsyncBaseTransport):
+    """The async side of the worker's pools as an httpx transport; closing it leaves the pools open."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        pools = get_http_transport()
+        trace = _ConnectionTrace()
+        request.extensions["trace"] = trace.atrace
+        try:
+            with _map_errors():
+                response = await pools.async_pool_for(request).handle_async_request(_core_request(request))
+        finally:
+            pools.record(request, trace)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_AsyncResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        pass
+
+
+class SharedSyncTransport(httpx.BaseTransport):
+    """The sync side of the worker's pools, safe to use from several threads."""
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        pools = get_http_transport()
+        trace = _ConnectionTrace()
+        request.extensions["trace"] = trace.trace
+        try:
+            with _map_errors():
+                response = pools.sync_pool_for(request).handle_request(_core_request(request))
+        finally:
+            pools.record(request, trace)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_SyncResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    def close(self) -> None:
+        pass
+
+
+_http_transport: Optional[HTTPTransport] = None
+
+
+def get_http_transport() -> HTTPTransport:
+    """Per-worker pools, created on first use so connections are never shared across fork."""
+    global _http_transport
+    if _http_transport is None:
+        settings = get_settings()
+        upstream_hosts = {
+            httpx.URL(settings.MISTRAL_SERVER_URL or MISTRAL_API_ROOT).host: "mistral",
+            httpx.URL(settings.GOOGLE_API_ENDPOINT or GOOGLE_API_ROOT).host: "google",
+        }
+        _http_transport = HTTPTransport(
+            settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+            settings.HTTP_MAX_PAGE_CONNECTIONS,
+            settings.HTTP_KEEPALIVE_EXPIRY,
+            settings.HTTP2_ENABLED,
+            settings.DNS_CACHE_TTL,
+            upstream_hosts,
+        )
+    return _http_transport
+
+
+def async_client(**kwargs) -> httpx.AsyncClient:
+    """An httpx.AsyncClient over the shared pools; kwargs as for httpx.AsyncClient."""
+    return httpx.AsyncClient(transport=SharedAsyncTransport(), **kwargs)
+
+
+def sync_client(**kwargs) -> httpx.Client:
+    """An httpx.Client over the shared pools; kwargs as for httpx.Client."""
+    return httpx.Client(transport=SharedSyncTransport(), **kwargs)
+
+
+async def close_http_transport() -> None:
+    global _http_transport
+    if _http_transport is not None:
+        await _http_transport.aclose()
+        _http_transport = None
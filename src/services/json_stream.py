@@ -0,0 +1,147 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Events produced by JSONObjectStreamParser.feed
+DELTA = "delta"  # (DELTA, key, text) - a decoded piece of a string value
+FIELD = "field"  # (FIELD, key, value) - a top-level value is complete
+
+
+class JSONObjectStreamParser:
+    """
+    Incremental parser for a single top-level JSON object arriving in chunks.
+
+    String values are reported piece by piece as they are decoded, and every
+    top-level value is reported once it is complete. Nested values are
+    buffered and decoded with json.loads. Anything before the opening brace
+    (e.g. a stray Markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self._state = "start"
+        self._key = ""
+        self._key_raw: List[str] = []
+        self._value: List[str] = []
+        self._escape: Optional[str] = None
+        self._pending_high: Optional[int] = None
+        self._depth = 0
+        self._raw_in_string = False
+        self._raw_escape = False
+        self.done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str, Any]]:
+        events: List[Tuple[str, str, Any]] = []
+        delta: List[str] = []
+
+        for ch in chunk:
+            if self.done:
+                break
+            state = self._state
+
+            if state == "start":
+                if ch == "{":
+                    self._state = "key_or_end"
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._key_raw = []
+                    self._state = "key"
+                elif ch == "}":
+                    self.done = True
+            elif state == "key":
+                if self._escape is not None or ch == "\\":
+                    self._key_raw.append(ch)
+                    self._escape = None if self._escape is not None else ch
+                elif ch == '"':
+                    self._key = json.loads('"' + "".join(self._key_raw) + '"')
+                    self._state = "colon"
+                else:
+                    self._key_raw.append(ch)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value_start"
+            elif state == "value_start":
+                if ch.isspace():
+                    continue
+                self._value = []
+                if ch == '"':
+                    self._state = "string"
+                else:
+                    self._depth = 1 if ch in "[{" else 0
+                    self._raw_in_string = False
+                    self._raw_escape = False
+                    self._value.append(ch)
+                    self._state = "raw"
+            elif state == "string":
+                text = self._consume_string_char(ch)
+                if text is None:
+                    if delta:
+                        events.append((DELTA, self._key, "".join(delta)))
+                        delta = []
+                    events.append((FIELD, self._key, "".join(self._value)))
+                    self._state = "after_value"
+                elif text:
+                    delta.append(text)
+                    self._value.append(text)
+            elif state == "raw":
+                if self._raw_in_string:
+                    self._value.append(ch)
+                    if self._raw_escape:
+                        self._raw_escape = False
+                    elif ch == "\\":
+                        self._raw_escape = True
+                    elif ch == '"':
+                        self._raw_in_string = False
+                elif self._depth == 0 and ch in ",}":
+                    events.append((FIELD, self._key, json.loads("".join(self._value))))
+                    self._state = "key_or_end"
+                    if ch == "}":
+                        self.done = True
+                else:
+                    if ch == '"':
+                        self._raw_in_string = True
+                    elif ch in "[{":
+                        self._depth += 1
+                    elif ch in "]}":
+                        self._depth -= 1
+                    self._value.append(ch)
+                    if self._depth == 0 and ch in "]}":
+                        events.append((FIELD, self._key, json.loads("".join(self._value))))
+                        self._state = "after_value"
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self.done = True
+
+        if delta:
+            events.append((DELTA, self._key, "".join(delta)))
+        return events
+
+    def _consume_string_char(self, ch: str) -> Optional[str]:
+        """Return decoded text for ch ("" while inside an escape), or None at the closing quote."""
+        if self._escape is None:
+            if ch == "\\":
+                self._escape = ""
+                return ""
+            if ch == '"':
+                return None
+            return ch
+
+        self._escape += ch
+        if self._escape[0] != "u":
+            text = _ESCAPES.get(self._escape, self._escape)
+            self._escape = None
+            return text
+        if len(self._escape) < 5:
+            return ""
+        code = int(self._escape[1:], 16)
+        self._escape = None
+        if 0xD800 <= code < 0xDC00:
+            # High surrogate, wait for the low half
+            self._pending_high = code
+            return ""
+        high, self._pending_high = self._pending_high, None
+        if high is not None and 0xDC00 <= code < 0xE000:
+            return chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00))
+        return chr(code)
@@ -3,40 +3,123 @@ from langchain_core.tools import Tool
 from langchain_mistralai.chat_models import ChatMistralAI
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.memory import BaseMemory
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage, BaseMessage
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
 from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
 from src.config import get_settings
-from langchain_google_community import GoogleSearchAPIWrapper
 from schemas.request import PredictionResponse
 import json
 from pydantic import HttpUrl
 import logging
 import time
 from functools import lru_cache
+from src.cache.search_cache import get_search_cache
+from src.retrieval.index import asearch_local_index, search_local_index
+from src.services.context_packer import pack_context
+from src.services.google_mistral_service import acustomsearch, customsearch, deadline_reasoning
+from src.services.http_transport import MISTRAL_API_ROOT, async_client, sync_client
+from src.services.model_router import get_model_router
+from src.services.session_memory import format_history, get_session_memory
+from src.services.upstream import UpstreamUnavailable, get_upstream
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+from utils.metrics import AGENT_ITERATIONS, CONTEXT_TOKENS_SAVED, SEARCHES, record_token_usage
+from utils.timing import stage
+from utils.deadline import DeadlineExceeded, run_within
+from utils.tracing import span, start_span
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+class UpstreamChatMistralAI(ChatMistralAI):
+    """ChatMistralAI whose calls go through the shared rate limiter, retries and circuit breaker."""
+
+    async def _agenerate(self, *args: Any, **kwargs: Any):
+        parent = super(UpstreamChatMistralAI, self)
+        return await get_upstream("mistral").call(lambda: parent._agenerate(*args, **kwargs))
+
+
+# Clients are built on first use in each process: with gunicorn --preload the
+# master imports this module, and the workers must not share its connections
+@lru_cache()
+def get_llm() -> UpstreamChatMistralAI:
+    # Requests go through the worker's shared connection pools, the clients only
+    # carry the base URL, credentials and timeout ChatMistralAI would give its own
+    client_options = {
+        "base_url": f"{settings.MISTRAL_SERVER_URL or MISTRAL_API_ROOT}/v1",
+        "headers": {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {settings.MISTRAL_API_KEY}",
+        },
+        "timeout": settings.MISTRAL_TIMEOUT,  # Ceiling per call, the request deadline cuts it shorter
+    }
+    return UpstreamChatMistralAI(
+        api_key=settings.MISTRAL_API_KEY,
+        model=get_model_router().model_for("agent"),
+        temperature=settings.TEMPERATURE,  # Lower temperature for faster and more focused responses
+        max_tokens=settings.MAX_TOKENS,
+        max_retries=1,  # A single attempt, retries are made by the upstream layer
+        endpoint=client_options["base_url"],
+        client=sync_client(**client_options),
+        async_client=async_client(**client_options),
+    )
+
+def _search_items(response: Dict) -> List[Dict]:
+    return [
+        {"title": item.get("title", ""), "link": item["link"], "snippet": item.get("snippet", "")}
+        for item in response.get("items", [])
+    ]
+
+def google_search(query: str, num_results: int = 5) -> List[Dict]:
+    """Google search that is safe to run from several threads at once."""
+    return _search_items(customsearch({"q": query, "cx": settings.GOOGLE_CSE_ID, "num": num_results}))
+
+async def agoogle_search(query: str, num_results: int = 5) -> List[Dict]:
+    """google_search on the event loop, cancelled with the task awaiting it."""
+    return _search_items(await acustomsearch({"q": query, "cx": settings.GOOGLE_CSE_ID, "num": num_results}))
 
-# Initialize the Mistral LLM
-llm = ChatMistralAI(
-    api_key=settings.MISTRAL_API_KEY,
-    model=settings.MODEL_NAME,
-    temperature=settings.TEMPERATURE,  # Lower temperature for faster and more focused responses
-    max_tokens=settings.MAX_TOKENS,
-    request_timeout=10.0  # Add timeout to prevent long-running requests
-)
-
-# Initialize Google Search with caching
-search = GoogleSearchAPIWrapper(
-    google_api_key=settings.GOOGLE_API_KEY,
-    google_cse_id=settings.GOOGLE_CSE_ID
-)
-
-@lru_cache(maxsize=100)
 def cached_search(query: str) -> List[Dict]:
     """Cached version of Google search to avoid repeated queries"""
-    return search.results(query, num_results=5)  # Reduced to 5 results for faster response
+    # The local itmo.ru index answers most questions without a Google call
+    with stage("local_search"):
+        local_results = search_local_index(query)
+    if local_results is not None:
+        SEARCHES.labels("local_index").inc()
+        return local_results
+
+    search_cache = get_search_cache()
+    results = search_cache.get(query)
+    if results is not None:
+        SEARCHES.labels("cache").inc()
+    else:
+        SEARCHES.labels("google").inc()
+        with stage("search"):
+            results = get_upstream("google").call_sync(
+                lambda: google_search(query, num_results=5)  # Reduced to 5 results for faster response
+            )
+        search_cache.set(query, results)
+    return results
+
+async def acached_search(query: str) -> List[Dict]:
+    """cached_search for async callers; a cancelled search stops its Google call."""
+    with stage("local_search"):
+        local_results = await asearch_local_index(query)
+    if local_results is not None:
+        SEARCHES.labels("local_index").inc()
+        return local_results
+
+    search_cache = get_search_cache()
+    results = await search_cache.aget(query)
+    if results is not None:
+        SEARCHES.labels("cache").inc()
+    else:
+        SEARCHES.labels("google").inc()
+        with stage("search"):
+            results = await get_upstream("google").call(lambda: agoogle_search(query, num_results=5))
+        await search_cache.aset(query, results)
+    return results
+
 
 def top_search(query: str) -> str:
     """
@@ -51,7 +134,16 @@ def top_search(query: str) -> str:
     try:
         # Execute search with caching
         results = cached_search(query)
-        
+
+        # Drop duplicate pages, rank and keep within the tool's token budget
+        results, context_stats = pack_context(
+            query, results, settings.CONTEXT_TOOL_TOKEN_BUDGET, settings.CONTEXT_ITMO_BOOST
+        )
+        # One observation per tool call, a ReAct run may search several times
+        CONTEXT_TOKENS_SAVED.labels("agent_tool").observe(context_stats["tokens_saved"])
+        if not results:
+            return "No good Google Search Result was found"
+
         # Format results
         formatted_results = []
         for item in results:
@@ -85,26 +177,6 @@ tools = [
     )
 ]
 
-# Create custom memory implementation
-class ConversationMemory(BaseMemory):
-    chat_history: List[Dict] = []
-    
-    @property
-    def memory_variables(self) -> List[str]:
-        return ["chat_history"]
-    
-    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        return {"chat_history": self.chat_history}
-    
-    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
-        if inputs.get("input"):
-            self.chat_history.append(HumanMessage(content=inputs["input"]))
-        if outputs.get("output"):
-            self.chat_history.append(AIMessage(content=outputs["output"]))
-    
-    def clear(self) -> None:
-        self.chat_history = []
-
 # Create the agent prompt
 template = """You are an intelligent assistant representing ITMO University. You must be fully polite, serious, and maintain a professional status.
 
@@ -177,32 +249,94 @@ Final Answer: [Твой итоговый ответ. Переведи итого
 
 Do your best!
 
+Previous conversation in this session (empty if there is none):
+{chat_history}
+
 Question: {input}
 Thought: {agent_scratchpad}"""
 
 # Create the prompt template
 prompt = ChatPromptTemplate.from_template(template)
 
-# Create memory
-memory = ConversationMemory()
-
-# Create the agent
-agent = create_react_agent(
-    llm=llm,
-    tools=tools,
-    prompt=prompt
-)
-
-# Create the agent executor with optimized settings
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    memory=memory,
-    verbose=True,
-    max_iterations=3,  # Reduced max iterations
-    handle_parsing_errors=True,
-    return_intermediate_steps=True
-)
+@lru_cache()
+def get_agent_executor() -> AgentExecutor:
+    # Create the agent
+    agent = create_react_agent(
+        llm=get_llm(),
+        tools=tools,
+        prompt=prompt
+    )
+
+    # Create the agent executor with optimized settings
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=settings.AGENT_VERBOSE,
+        max_iterations=3,  # Reduced max iterations
+        handle_parsing_errors=True,
+        return_intermediate_steps=True
+    )
+
+class TokenUsageCallback(AsyncCallbackHandler):
+    """Counts the tokens of every LLM call the agent makes."""
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        record_token_usage("agent", (response.llm_output or {}).get("token_usage"))
+
+
+token_usage_callback = TokenUsageCallback()
+
+
+class TraceCallback(AsyncCallbackHandler):
+    """Records every LLM call and tool call of the agent as a span of the request trace."""
+
+    def __init__(self):
+        self.spans = {}
+        self.llm_calls = 0
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id, **kwargs: Any) -> None:
+        self.llm_calls += 1
+        self.spans[run_id] = start_span("agent_llm", step=self.llm_calls)
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id, **kwargs: Any) -> None:
+        self.llm_calls += 1
+        self.spans[run_id] = start_span("agent_llm", step=self.llm_calls)
+
+    async def on_llm_end(self, response: LLMResult, *, run_id, **kwargs: Any) -> None:
+        self._finish(run_id, tokens=(response.llm_output or {}).get("token_usage"))
+
+    async def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._finish(run_id, error=type(error).__name__)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id, **kwargs: Any) -> None:
+        self.spans[run_id] = start_span(
+            f"agent_tool_{serialized.get('name', 'tool')}", step=self.llm_calls, input=input_str[:200]
+        )
+
+    async def on_tool_end(self, output: Any, *, run_id, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    async def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        self._finish(run_id, error=type(error).__name__)
+
+    def _finish(self, run_id, **attrs) -> None:
+        trace_span = self.spans.pop(run_id, None)
+        if trace_span is not None:
+            trace_span.finish(**{key: value for key, value in attrs.items() if value is not None})
+
+class SourceCollector(AsyncCallbackHandler):
+    """Keeps the links returned by the search tool, to answer with when the deadline runs out."""
+
+    def __init__(self):
+        self.links: List[str] = []
+
+    async def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        for line in str(output).splitlines():
+            if line.startswith("Link: "):
+                link = line[len("Link: "):].strip()
+                if link and link not in self.links:
+                    self.links.append(link)
+
 
 def format_tool_messages(intermediate_steps) -> List[Dict]:
     """Format intermediate steps into proper tool messages."""
@@ -212,13 +346,16 @@ def format_tool_messages(intermediate_steps) -> List[Dict]:
         messages.append(ToolMessage(content=str(observation), tool_call_id=None))
     return messages
 
-async def process_request(user_input: str, request_id: str) -> Dict[str, Any]:
+async def process_request(
+    user_input: str, request_id: str, session_id: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Process a user request through the agent pipeline.
     
     Args:
         user_input: The user's query or request
         request_id: The ID of the request
+        session_id: Optional conversation session, its history is passed to the agent
         
     Returns:
         Dictionary containing the response data with status, answer, reasoning, and sources
@@ -227,14 +364,35 @@ async def process_request(user_input: str, request_id: str) -> Dict[str, Any]:
         # Initialize agent processing
         intermediate_steps = []
         
-        # Format and invoke agent with timeout
-        response = await agent_executor.ainvoke({
-            "input": user_input,
-            "agent_scratchpad": format_tool_messages(intermediate_steps)
-        })
+        # Conversation history is kept per session, requests without a session get none
+        session_memory = get_session_memory()
+        chat_history = format_history(await session_memory.ahistory(session_id))
+
+        # Format and invoke agent within the request deadline
+        sources = SourceCollector()
+        try:
+            with stage("agent"):
+                response = await run_within(get_agent_executor().ainvoke({
+                    "input": user_input,
+                    "chat_history": chat_history,
+                    "agent_scratchpad": format_tool_messages(intermediate_steps)
+                }, config={"callbacks": [token_usage_callback, TraceCallback(), sources]}), "agent")
+        except DeadlineExceeded:
+            # The agent was cancelled, answer with what its searches found so far
+            return {
+                "status": "partial",
+                "response": deadline_reasoning(user_input),
+                "metadata": {
+                    "answer": None,
+                    "sources": sources.links[:3]
+                }
+            }
+        AGENT_ITERATIONS.observe(len(response.get("intermediate_steps", [])))
         
         message_content = response["output"]
-        response_data = json.loads(message_content)
+        with span("parse_json"):
+            response_data = json.loads(message_content)
+        await session_memory.aappend(session_id, user_input, message_content)
                 
         return {
             "status": "success",
@@ -246,7 +404,11 @@ async def process_request(user_input: str, request_id: str) -> Dict[str, Any]:
                 "iterations": len(response.get("intermediate_steps", []))
             }
         }
+    except UpstreamUnavailable:
+        # Reported to the client as 503, not as an answer
+        raise
     except Exception as e:
+        logger.warning("Agent request %s failed: %s", request_id, e)
         # Quick error response
         return {
             "status": "error",
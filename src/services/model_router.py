@@ -0,0 +1,99 @@
+"""
+Per-stage model routing.
+
+Each LLM stage (validation, answer, plan, synthesis, agent) is served by the
+model configured in MODEL_ROUTES. A stage listed in MODEL_ESCALATIONS is
+tried with its (small, fast) routed model first and repeated with the
+escalation model only when the output does not parse or is not confident
+enough. Every decision and the latency of every model call are recorded.
+"""
+import json
+import time
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from src.config import get_settings
+from utils.metrics import MODEL_CALL_SECONDS, MODEL_ROUTING_DECISIONS
+
+T = TypeVar("T")
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        routes: Dict[str, str],
+        escalations: Dict[str, str],
+        default_model: str,
+        min_confidence: float = 0.6,
+    ):
+        self.routes = routes
+        self.escalations = escalations
+        self.default_model = default_model
+        self.min_confidence = min_confidence
+
+    def model_for(self, stage: str) -> str:
+        return self.routes.get(stage, self.default_model)
+
+    def escalation_for(self, stage: str) -> Optional[str]:
+        escalation = self.escalations.get(stage)
+        return escalation if escalation and escalation != self.model_for(stage) else None
+
+    def confident(self, result: Dict) -> bool:
+        """A result without a confidence field is taken as confident."""
+        confidence = result.get("confidence", 1.0)
+        return not isinstance(confidence, (int, float)) or confidence >= self.min_confidence
+
+    def _record(self, stage: str, model: str, decision: str) -> None:
+        MODEL_ROUTING_DECISIONS.labels(stage, model, decision).inc()
+
+    async def _timed(self, stage: str, model: str, call: Callable[[str], Awaitable[T]]) -> T:
+        start_time = time.perf_counter()
+        try:
+            return await call(model)
+        finally:
+            MODEL_CALL_SECONDS.labels(stage, model).observe(time.perf_counter() - start_time)
+
+    async def run(
+        self,
+        stage: str,
+        call: Callable[[str], Awaitable[T]],
+        accept: Optional[Callable[[T], bool]] = None,
+    ) -> T:
+        """
+        Run call(model) with the stage's model, escalating when call raises a
+        JSON parsing error or accept rejects the result. Without an escalation
+        model the first result (or parsing error) is final.
+        """
+        model = self.model_for(stage)
+        escalation = self.escalation_for(stage)
+        try:
+            result = await self._timed(stage, model, call)
+        except json.JSONDecodeError:
+            if escalation is None:
+                self._record(stage, model, "unparsed")
+                raise
+            self._record(stage, model, "escalated_unparsed")
+        else:
+            if escalation is None or accept is None or accept(result):
+                self._record(stage, model, "accepted")
+                return result
+            self._record(stage, model, "escalated_low_confidence")
+
+        try:
+            result = await self._timed(stage, escalation, call)
+        except json.JSONDecodeError:
+            self._record(stage, escalation, "unparsed")
+            raise
+        self._record(stage, escalation, "accepted")
+        return result
+
+
+@lru_cache()
+def get_model_router() -> ModelRouter:
+    settings = get_settings()
+    return ModelRouter(
+        settings.MODEL_ROUTES,
+        settings.MODEL_ESCALATIONS if settings.MODEL_ESCALATION_ENABLED else {},
+        settings.MODEL_NAME,
+        settings.MODEL_ESCALATION_MIN_CONFIDENCE,
+    )
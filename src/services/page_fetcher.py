@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from src.cache.backends import CacheBackend, create_backend
+from src.config import get_settings
+from src.retrieval.text import extract_main_text, split_passages
+from src.services.context_packer import bm25_scores, canonical_url
+from src.services.http_transport import async_client
+from utils.metrics import PAGE_FETCHES
+
+logger = logging.getLogger(__name__)
+
+_TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+
+
+class _HostLimit:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class PageFetcher:
+    """
+    Fetches result pages to give the answer prompt more than Google's snippets.
+
+    Requests go through the worker's shared connection pools, at most
+    per_host_limit at a time per host; a host's limit is dropped once no
+    request to it is running or waiting. Extracted page text is cached; once an entry is older than
+    fresh_ttl it is revalidated with If-None-Match/If-Modified-Since, so an
+    unchanged page costs a 304 instead of a full download.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        cache: CacheBackend,
+        per_host_limit: int = 2,
+        max_bytes: int = 1_000_000,
+        fresh_ttl: float = 60 * 60,
+    ):
+        self.client = client
+        self.cache = cache
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.fresh_ttl = fresh_ttl
+        self._host_limits: Dict[str, _HostLimit] = {}
+
+    def _count(self, result: str) -> None:
+        PAGE_FETCHES.labels(result).inc()
+
+    @contextlib.asynccontextmanager
+    async def _host_limit(self, url: str) -> AsyncIterator[None]:
+        host = httpx.URL(url).host
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = _HostLimit(self.per_host_limit)
+        limit.users += 1
+        try:
+            async with limit.semaphore:
+                yield
+        finally:
+            limit.users -= 1
+            if limit.users == 0:
+                del self._host_limits[host]
+
+    async def fetch_text(self, url: str) -> Optional[str]:
+        """Return the main text of the page at url, or None if it cannot be fetched."""
+        key = f"page:{canonical_url(url)}"
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None and time.time() - entry["fetched_at"] < self.fresh_ttl:
+            self._count("fresh")
+            return entry["text"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            async with self._host_limit(url):
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and entry is not None:
+                        self._count("not_modified")
+                        entry["fetched_at"] = time.time()
+                        await asyncio.to_thread(self.cache.set, key, entry)
+                        return entry["text"]
+
+                    content_type = response.headers.get("content-type", "")
+                    if response.status_code != 200 or not content_type.startswith(_TEXT_CONTENT_TYPES):
+                        self._count("failed")
+                        return None
+
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body.extend(chunk)
+                        if len(body) >= self.max_bytes:
+                            break
+                    html = body[:self.max_bytes].decode(response.encoding or "utf-8", errors="replace")
+        except httpx.HTTPError as e:
+            logger.warning("Page fetch error for %s: %s", url, e)
+            self._count("failed")
+            return None
+
+        if content_type.startswith("text/plain"):
+            text = html
+        else:
+            text = (await asyncio.to_thread(extract_main_text, html))["text"]
+
+        self._count("fetched")
+        await asyncio.to_thread(self.cache.set, key, {
+            "text": text,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "fetched_at": time.time(),
+        })
+        return text
+
+    async def fetch_many(self, urls: List[str], deadline: float) -> Dict[str, str]:
+        """Fetch pages concurrently, giving up on those not done within deadline seconds."""
+        tasks = {asyncio.ensure_future(self.fetch_text(url)): url for url in urls}
+        if not tasks:
+            return {}
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+
+        texts = {}
+        for task in done:
+            if not task.cancelled() and task.exception() is None and task.result():
+                texts[tasks[task]] = task.result()
+        return texts
+
+    async def enrich(
+        self,
+        question: str,
+        results: List[Dict],
+        top_n: int,
+        deadline: float,
+        passages_per_page: int = 2,
+    ) -> List[Dict]:
+        """
+        Append the passages of the top_n result pages that best match the
+        question to their snippets. Results whose page could not be fetched
+        in time keep their original snippet.
+        """
+        urls = [r["link"] for r in results[:top_n] if r.get("link", "").startswith(("http://", "https://"))]
+        texts = await self.fetch_many(urls, deadline)
+
+        enriched = []
+        for result in results:
+            text = texts.get(result.get("link"))
+            if text:
+                passages = split_passages(text)
+                scores = bm25_scores(question, passages)
+                best = sorted(zip(scores, passages), key=lambda item: item[0], reverse=True)
+                best_passages = [p for score, p in best[:passages_per_page] if score > 0]
+                if best_passages:
+                    result = {**result, "snippet": " … ".join([result.get("snippet", "")] + best_passages)}
+            enriched.append(result)
+        return enriched
+
+
+_page_fetcher: Optional[PageFetcher] = None
+
+
+def get_page_fetcher() -> PageFetcher:
+    """Per-worker fetcher, created on first use."""
+    global _page_fetcher
+    if _page_fetcher is None:
+        settings = get_settings()
+        client = async_client(
+            timeout=httpx.Timeout(settings.PAGE_FETCH_TIMEOUT),
+            follow_redirects=True,
+            headers={"User-Agent": "itmo-megaschool-agent/1.0"},
+        )
+        cache = create_backend(
+            settings.PAGE_CACHE_BACKEND,
+            settings.PAGE_CACHE_PATH,
+            max_entries=settings.PAGE_CACHE_MAX_ENTRIES,
+            default_ttl=settings.PAGE_CACHE_TTL,
+            table="page_cache",
+        )
+        _page_fetcher = PageFetcher(
+            client,
+            cache,
+            per_host_limit=settings.PAGE_FETCH_PER_HOST_LIMIT,
+            max_bytes=settings.PAGE_FETCH_MAX_BYTES,
+            fresh_ttl=settings.PAGE_CACHE_FRESH_TTL,
+        )
+    return _page_fetcher
@@ -0,0 +1,66 @@
+import re
+from typing import Dict
+
+from src.cache.answer_cache import split_query
+from src.retrieval.text import detect_language
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+_ITMO_RE = re.compile(
+    r"\b(итмо|ифмо|itmo|ifmo)\b"
+    r"|университет\w* информационных технологий,? механики и оптики"
+    r"|university of information technologies,? mechanics and optics",
+    re.I,
+)
+
+# Attempts to steer the assistant, left for the LLM validation to judge
+_SUSPICIOUS_RE = re.compile(
+    r"ignore (all |any |the )?(previous|above|prior)|disregard|system prompt|jailbreak|pretend|"
+    r"you are now|act as|developer mode|"
+    r"игнорируй|забудь|системн\w+ промпт|представь, что ты|ты теперь|притворись",
+    re.I,
+)
+
+MAX_FAST_PATH_LENGTH = 1000
+
+
+def question_similarity(left: str, right: str) -> float:
+    """Jaccard similarity of the lowercased word sets of two questions."""
+    left_words = set(_WORD_RE.findall(left.lower()))
+    right_words = set(_WORD_RE.findall(right.lower()))
+    if not left_words or not right_words:
+        return 0.0
+    return len(left_words & right_words) / len(left_words | right_words)
+
+
+def preclassify(query: str) -> Dict:
+    """
+    Classify a query locally, without an LLM call.
+
+    Returns the same fields as GoogleMistralService.validate_and_extract_questions
+    plus language, options and confident. Only confident results may skip
+    the LLM validation; everything else has to fall back to it.
+    """
+    question, options = split_query(query)
+    question = question.strip()
+    # Detect the language on the question only, options are often in English
+    language = detect_language(question)
+
+    confident = (
+        language in ("ru", "en")
+        and bool(question)
+        and len(query) <= MAX_FAST_PATH_LENGTH
+        and _ITMO_RE.search(query) is not None
+        and _SUSPICIOUS_RE.search(query) is None
+    )
+
+    return {
+        "is_valid": True,
+        "is_ethical": True,
+        "question_ru": question if language == "ru" else None,
+        "question_en": question if language == "en" else None,
+        "question": question,
+        "language": language,
+        "options": options,
+        "confident": confident,
+    }
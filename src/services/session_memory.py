@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from src.cache.backends import CacheBackend, create_backend
+from src.config import get_settings
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _to_message(entry: Dict[str, str]) -> BaseMessage:
+    if entry["role"] == "user":
+        return HumanMessage(content=entry["content"])
+    return AIMessage(content=entry["content"])
+
+
+class SessionMemoryStore:
+    """
+    Conversation history kept per session id in a cache backend.
+
+    With the SQLite backend every worker sees the same history, so a session
+    keeps its context whichever worker serves the next request. Each session
+    is trimmed from the oldest message to stay within max_messages and
+    max_tokens. Sessions idle for longer than ttl expire, and the least
+    recently used sessions are evicted when there are more than max_sessions
+    of them, which also bounds the total size to max_sessions * max_tokens.
+
+    Two requests of the same session served at the same time both append to
+    the history they read, so one of the two turns may be lost.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        max_messages: int = 20,
+        max_tokens: int = 4000,
+        ttl: float = 30 * 60,
+    ):
+        self.backend = backend
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+
+    def _key(self, session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def _entries(self, session_id: str) -> List[Dict[str, str]]:
+        try:
+            return self.backend.get(self._key(session_id)) or []
+        except Exception as e:
+            # A broken store must never fail the request, run without history
+            logger.warning("Session store read error: %s", e)
+            return []
+
+    def history(self, session_id: Optional[str]) -> List[BaseMessage]:
+        if session_id is None:
+            return []
+        entries = self._entries(session_id)
+        if entries:
+            # Reading counts as use: extend the session's TTL
+            self._save(session_id, entries)
+        return [_to_message(entry) for entry in entries]
+
+    def append(self, session_id: Optional[str], user_input: str, output: str) -> None:
+        if session_id is None:
+            return
+        entries = self._entries(session_id)
+        entries.append({"role": "user", "content": user_input})
+        entries.append({"role": "assistant", "content": output})
+
+        tokens = sum(estimate_tokens(entry["content"]) for entry in entries)
+        while entries and (len(entries) > self.max_messages or tokens > self.max_tokens):
+            tokens -= estimate_tokens(entries.pop(0)["content"])
+        self._save(session_id, entries)
+
+    def clear(self, session_id: str) -> None:
+        try:
+            self.backend.delete(self._key(session_id))
+        except Exception as e:
+            logger.warning("Session store write error: %s", e)
+
+    def _save(self, session_id: str, entries: List[Dict[str, str]]) -> None:
+        try:
+            self.backend.set(self._key(session_id), entries, ttl=self.ttl)
+        except Exception as e:
+            logger.warning("Session store write error: %s", e)
+
+    async def ahistory(self, session_id: Optional[str]) -> List[BaseMessage]:
+        if session_id is None:
+            return []
+        return await asyncio.to_thread(self.history, session_id)
+
+    async def aappend(self, session_id: Optional[str], user_input: str, output: str) -> None:
+        if session_id is None:
+            return
+        await asyncio.to_thread(self.append, session_id, user_input, output)
+
+
+@lru_cache()
+def get_session_memory() -> SessionMemoryStore:
+    settings = get_settings()
+    backend = create_backend(
+        settings.SESSION_BACKEND,
+        settings.SESSION_PATH,
+        max_entries=settings.SESSION_MAX_SESSIONS,
+        default_ttl=settings.SESSION_TTL,
+        table="sessions",
+    )
+    return SessionMemoryStore(
+        backend,
+        max_messages=settings.SESSION_MAX_MESSAGES,
+        max_tokens=settings.SESSION_MAX_TOKENS,
+        ttl=settings.SESSION_TTL,
+    )
+
+
+def format_history(messages: List[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        role = "User" if isinstance(message, HumanMessage) else "Assistant"
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
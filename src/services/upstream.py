@@ -0,0 +1,301 @@
+"""
+Shared protection for calls to Mistral and Google.
+
+Every call goes through the Upstream of its backend, which
+- waits for a token of a client-side rate limiter sized to the backend's quota,
+- retries 429, 5xx and network errors with jittered exponential backoff,
+  honouring Retry-After,
+- counts failures in a circuit breaker, and while the breaker is open fails
+  immediately with UpstreamUnavailable instead of queueing more work.
+
+UpstreamUnavailable carries a retry_after hint that the endpoints return as
+503 + Retry-After. The state is per worker process, so the rate limits are per worker too.
+"""
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+
+from src.config import get_settings
+from utils.deadline import time_left
+from utils.metrics import CIRCUIT_STATE, UPSTREAM_CALLS
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream is failing, rate limited or its circuit breaker is open."""
+
+    def __init__(self, backend: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"{backend} is unavailable: {reason}")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+def _status_of(error: BaseException) -> Optional[int]:
+    # mistralai SDKError and httpx.HTTPStatusError (langchain, Google)
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int) and status > 0:
+        return status
+    response = getattr(error, "response", None) or getattr(error, "raw_response", None)
+    if response is not None and isinstance(getattr(response, "status_code", None), int):
+        return response.status_code
+    return None
+
+
+def _retry_after_of(error: BaseException) -> Optional[float]:
+    headers = None
+    for attr in ("response", "raw_response"):
+        response = getattr(error, attr, None)
+        if response is not None and hasattr(response, "headers"):
+            headers = response.headers
+            break
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limiting, server errors and network failures are worth another attempt."""
+    status = _status_of(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    """Client-side rate limit: rate tokens per second, up to burst saved up."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. After reset_timeout
+    one probe call is let through (half open); its success closes the breaker,
+    its failure opens it again.
+    """
+
+    def __init__(self, backend: str, failure_threshold: int, reset_timeout: float):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_STATE.labels(self.backend).set(_STATE_VALUES[state])
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        UPSTREAM_CALLS.labels(self.backend, "rejected").inc()
+        raise UpstreamUnavailable(self.backend, "circuit breaker is open", max(1.0, remaining))
+
+    def release_probe(self) -> None:
+        """The probe call ended without a verdict (cancelled or not started)."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._probing = False
+                self._set_state(OPEN)
+
+
+class Upstream:
+    """Rate limiter, retry policy and circuit breaker of one backend."""
+
+    def __init__(
+        self,
+        backend: str,
+        rate: float,
+        burst: int,
+        max_attempts: int = 3,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        retry_after_max: float = 10.0,
+        max_queue_wait: float = 5.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.backend = backend
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(backend, failure_threshold, reset_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.max_queue_wait = max_queue_wait
+
+    def _admit(self) -> float:
+        """Check the breaker and take a rate limit token; returns how long to wait for it."""
+        self.breaker.before_call()
+        wait = self.bucket.reserve()
+        limit = time_left(cap=self.max_queue_wait)
+        if wait > limit:
+            # Waiting longer would only pile up requests, shed this one
+            self.bucket.refund()
+            self.breaker.release_probe()
+            UPSTREAM_CALLS.labels(self.backend, "rate_limited").inc()
+            raise UpstreamUnavailable(self.backend, "client-side rate limit reached", wait)
+        return wait
+
+    def _retry_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to wait before the next attempt, None when the call should not be retried."""
+        if attempt >= self.max_attempts or not is_retryable(error):
+            return None
+        retry_after = _retry_after_of(error)
+        if retry_after is not None:
+            if retry_after > self.retry_after_max:
+                return None
+            delay = retry_after
+        else:
+            # Full jitter: anywhere between 0 and the exponential bound
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        remaining = time_left()
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def _give_up(self, error: BaseException) -> BaseException:
+        if not is_retryable(error):
+            # The upstream answered, the request itself was bad
+            UPSTREAM_CALLS.labels(self.backend, "error").inc()
+            return error
+        UPSTREAM_CALLS.labels(self.backend, "failure").inc()
+        retry_after = _retry_after_of(error) or self.breaker.reset_timeout
+        unavailable = UpstreamUnavailable(self.backend, str(error) or type(error).__name__, retry_after)
+        unavailable.__cause__ = error
+        return unavailable
+
+    def _record(self, error: Optional[BaseException]) -> None:
+        if error is None or not is_retryable(error):
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    async def call(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await factory() with rate limiting, retries and the circuit breaker."""
+        attempt = 0
+        while True:
+            attempt += 1
+            wait = self._admit()
+            try:
+                if wait:
+                    await asyncio.sleep(wait)
+                result = await factory()
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                self._record(e)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise self._give_up(e)
+                UPSTREAM_CALLS.labels(self.backend, "retry").inc()
+                await asyncio.sleep(delay)
+                continue
+            self._record(None)
+            UPSTREAM_CALLS.labels(self.backend, "success").inc()
+            return result
+
+    def call_sync(self, func: Callable[[], Any]) -> Any:
+        """call() for blocking code running in a worker thread."""
+        attempt = 0
+        while True:
+            attempt += 1
+            wait = self._admit()
+            if wait:
+                time.sleep(wait)
+            try:
+                result = func()
+            except Exception as e:
+                self._record(e)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise self._give_up(e)
+                UPSTREAM_CALLS.labels(self.backend, "retry").inc()
+                time.sleep(delay)
+                continue
+            self._record(None)
+            UPSTREAM_CALLS.labels(self.backend, "success").inc()
+            return result
+
+
+@lru_cache(maxsize=None)
+def get_upstream(backend: str) -> Upstream:
+    """The Upstream for "mistral" or "google", configured from settings."""
+    settings = get_settings()
+    rates = {
+        "mistral": (settings.MISTRAL_RATE_LIMIT, settings.MISTRAL_RATE_BURST),
+        "google": (settings.GOOGLE_RATE_LIMIT, settings.GOOGLE_RATE_BURST),
+    }
+    rate, burst = rates[backend]
+    return Upstream(
+        backend,
+        rate,
+        burst,
+        max_attempts=settings.UPSTREAM_MAX_ATTEMPTS,
+        backoff_base=settings.UPSTREAM_BACKOFF_BASE,
+        backoff_max=settings.UPSTREAM_BACKOFF_MAX,
+        retry_after_max=settings.UPSTREAM_RETRY_AFTER_MAX,
+        max_queue_wait=settings.UPSTREAM_MAX_QUEUE_WAIT,
+        failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+    )
@@ -0,0 +1,171 @@
+"""
+Admission control in front of the answer pipelines.
+
+Each endpoint gets a bounded pool of concurrent requests. Requests beyond it
+wait in a priority queue (lower priority value first, FIFO within a class) for
+at most the max wait of their class; when the queue is full or the wait runs
+out they are refused at once with 503 and a Retry-After estimate, instead of
+slowing down everything that is already running.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from utils.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+from utils.tracing import span
+
+
+class Overloaded(Exception):
+    def __init__(self, endpoint: str, reason: str, retry_after: float):
+        super().__init__(f"{endpoint} is overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency pool with a bounded priority queue for one endpoint (per worker)."""
+
+    def __init__(self, endpoint: str, max_concurrency: int, max_queue: int):
+        self.endpoint = endpoint
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.active = 0
+        self._queue: List = []
+        self._order = itertools.count()
+        # Moving average of how long an admitted request holds its slot
+        self._service_time = 1.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def retry_after(self) -> float:
+        """Rough time until a slot frees up for a new request."""
+        return max(1.0, (self.queued + 1) * self._service_time / self.max_concurrency)
+
+    async def acquire(self, priority: int = 0, priority_name: str = "interactive", max_wait: Optional[float] = None) -> None:
+        """Wait for a slot; raises Overloaded when the queue is full or max_wait passes first."""
+        if self.active < self.max_concurrency and not self._queue:
+            self.active += 1
+            ADMISSION_WAIT_SECONDS.labels(self.endpoint, priority_name).observe(0)
+            return
+
+        if self.queued >= self.max_queue:
+            ADMISSION_REJECTIONS.labels(self.endpoint, priority_name, "queue_full").inc()
+            raise Overloaded(self.endpoint, "queue is full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), waiter))
+        depth = ADMISSION_QUEUE_DEPTH.labels(self.endpoint, priority_name)
+        depth.inc()
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            ADMISSION_REJECTIONS.labels(self.endpoint, priority_name, "timeout").inc()
+            raise Overloaded(self.endpoint, "timed out in the queue", self.retry_after()) from None
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            depth.dec()
+            ADMISSION_WAIT_SECONDS.labels(self.endpoint, priority_name).observe(time.perf_counter() - start_time)
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as the wait ended, pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+            heapq.heapify(self._queue)
+
+    def release(self, held_for: Optional[float] = None) -> None:
+        if held_for is not None:
+            self._service_time = 0.9 * self._service_time + 0.1 * held_for
+        # Hand the slot straight to the first waiter still waiting
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(
+        self, priority: int = 0, priority_name: str = "interactive", max_wait: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        await self.acquire(priority, priority_name, max_wait)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start_time)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an AdmissionController per configured path.
+
+    The priority class comes from the X-Priority header (one of
+    priority_classes, highest priority first; the first is the default).
+    The slot is held until the response, streaming included, is complete.
+    """
+
+    def __init__(
+        self,
+        app,
+        controllers: Dict[str, AdmissionController],
+        priority_classes: Sequence[str] = ("interactive", "batch"),
+        max_wait: Optional[Dict[str, float]] = None,
+    ):
+        self.app = app
+        self.controllers = controllers
+        self.priorities = {name: index for index, name in enumerate(priority_classes)}
+        self.default_class = priority_classes[0]
+        self.max_wait = max_wait or {}
+
+    def _priority_class(self, scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"x-priority":
+                value = value.decode("latin-1").strip().lower()
+                if value in self.priorities:
+                    return value
+        return self.default_class
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controllers.get(scope["path"]) if scope["type"] == "http" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        priority_class = self._priority_class(scope)
+        try:
+            with span("admission", priority=priority_class):
+                await controller.acquire(
+                    self.priorities[priority_class], priority_class, self.max_wait.get(priority_class)
+                )
+        except Overloaded as e:
+            body = f'{{"detail":"Server is overloaded, retry later ({e.reason})"}}'.encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(e.retry_after)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.perf_counter() - start_time)
@@ -0,0 +1,173 @@
+"""
+Per-request deadline budget.
+
+The endpoint opens a deadline_scope for the request; every stage below it
+asks for its share of the time that is left (time_left) or runs under it
+(run_within), so one slow upstream call cannot use up the whole budget. The
+deadline lives in a context variable, so tasks started by the request inherit
+it. Without a scope nothing is limited.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Optional
+
+from utils.metrics import DEADLINES_EXCEEDED, HEDGED_CALLS
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before a stage could finish."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+def resolve_budget(requested: Optional[float], default: float, maximum: float) -> float:
+    """Deadline in seconds for a request, from its own value when given, never above maximum."""
+    if requested is None or requested <= 0:
+        return min(default, maximum)
+    return min(requested, maximum)
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[Deadline]:
+    deadline = Deadline(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def time_left(share: float = 1.0, cap: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds a stage may take: share of the remaining budget, at most cap.
+
+    Returns cap (None meaning unlimited) when the request has no deadline.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return cap
+    seconds = deadline.remaining() * share
+    return min(seconds, cap) if cap is not None else seconds
+
+
+async def run_within(awaitable: Awaitable[Any], stage: str, share: float = 1.0) -> Any:
+    """Await with a timeout of share of the remaining budget, cancelling the work when it runs out."""
+    timeout = time_left(share)
+    if timeout is None:
+        return await awaitable
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        DEADLINES_EXCEEDED.labels(stage).inc()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        DEADLINES_EXCEEDED.labels(stage).inc()
+        raise DeadlineExceeded(stage) from None
+
+
+async def gather_partial(awaitables: Iterable[Awaitable[Any]], stage: str, share: float = 1.0) -> List[Any]:
+    """
+    Run awaitables concurrently within share of the remaining budget.
+
+    Results come back in order; those not finished in time are cancelled and
+    returned as None instead of failing the whole group. Exceptions of
+    finished awaitables are raised as asyncio.gather would.
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=time_left(share))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    if pending:
+        DEADLINES_EXCEEDED.labels(stage).inc()
+        for task in pending:
+            task.cancel()
+    # Retrieve every exception, then raise the first one
+    errors = [task.exception() for task in tasks if task in done]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [task.result() if task in done else None for task in tasks]
+
+
+class LatencyTracker:
+    """Recent latencies of one upstream, for percentile-based hedging delays."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+async def hedged(backend: str, factory: Callable[[], Awaitable[Any]], delay: Optional[float]) -> Any:
+    """
+    Call factory, and call it a second time if the first call is still running
+    after delay seconds; the first successful result wins and the other call
+    is cancelled. A call failing before the hedge starts is not retried.
+    """
+    primary = asyncio.ensure_future(factory())
+    if delay is None:
+        HEDGED_CALLS.labels(backend, "not_hedged").inc()
+        return await primary
+
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            HEDGED_CALLS.labels(backend, "not_hedged").inc()
+            return primary.result()
+
+        tasks.append(asyncio.ensure_future(factory()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_CALLS.labels(backend, "primary" if task is primary else "hedge").inc()
+                    return task.result()
+                error = task.exception()
+        HEDGED_CALLS.labels(backend, "failed").inc()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
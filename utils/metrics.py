@@ -0,0 +1,154 @@
+"""
+Prometheus metrics for the service.
+
+Under gunicorn every worker writes its samples to memory-mapped files in
+PROMETHEUS_MULTIPROC_DIR (set in start.sh and cleaned by gunicorn.conf.py),
+and /metrics aggregates the files of all workers. Without that variable the
+default in-process registry is used.
+"""
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "itmo_request_seconds", "End-to-end request latency", ["endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "itmo_requests_in_flight", "Requests currently being processed", ["endpoint"], multiprocess_mode="livesum"
+)
+STAGE_SECONDS = Histogram(
+    "itmo_stage_seconds", "Latency of pipeline stages", ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "itmo_llm_tokens_total", "Tokens reported by Mistral", ["stage", "kind"]
+)
+AGENT_ITERATIONS = Histogram(
+    "itmo_agent_iterations", "Tool-using iterations per agent run", buckets=(0, 1, 2, 3, 4, 5, 8)
+)
+CACHE_LOOKUPS = Counter(
+    "itmo_cache_lookups_total", "Cache lookups by cache and result (hit, near_hit, miss)", ["cache", "result"]
+)
+COALESCED_REQUESTS = Counter(
+    "itmo_coalesced_requests_total", "Calls that joined an identical call already in flight", ["name"]
+)
+SEARCHES = Counter(
+    "itmo_searches_total", "Searches by where they were answered (local_index, cache, google)", ["source"]
+)
+PRECLASSIFIER_DECISIONS = Counter(
+    "itmo_preclassifier_decisions_total", "Queries by validation path (fast_path, llm_fallback)", ["path"]
+)
+SPECULATIVE_SEARCHES = Counter(
+    "itmo_speculative_searches_total", "Speculative searches by outcome (used, topped_up, discarded)", ["outcome"]
+)
+CONTEXT_TOKENS_SAVED = Histogram(
+    "itmo_context_tokens_saved", "Prompt tokens removed by context packing, per packed prompt", ["pipeline"],
+    buckets=(0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+PAGE_FETCHES = Counter(
+    "itmo_page_fetches_total", "Page fetches by result (fetched, not_modified, fresh, failed)", ["result"]
+)
+DEADLINES_EXCEEDED = Counter(
+    "itmo_deadlines_exceeded_total", "Stages cut short by the request deadline", ["stage"]
+)
+HEDGED_CALLS = Counter(
+    "itmo_hedged_calls_total", "Hedged upstream calls by outcome (not_hedged, primary, hedge, failed)", ["backend", "outcome"]
+)
+UPSTREAM_CALLS = Counter(
+    "itmo_upstream_calls_total",
+    "Upstream calls by outcome (success, retry, error, failure, rejected, rate_limited)",
+    ["backend", "outcome"],
+)
+CIRCUIT_STATE = Gauge(
+    "itmo_circuit_state", "Circuit breaker state (0 closed, 1 half open, 2 open)", ["backend"],
+    multiprocess_mode="max",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "itmo_admission_queue_depth", "Requests waiting for admission", ["endpoint", "priority"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "itmo_admission_wait_seconds", "Time spent waiting for admission", ["endpoint", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTIONS = Counter(
+    "itmo_admission_rejections_total", "Requests refused with 503 by reason (queue_full, timeout)",
+    ["endpoint", "priority", "reason"],
+)
+MODEL_ROUTING_DECISIONS = Counter(
+    "itmo_model_routing_decisions_total",
+    "Model calls by stage and outcome (accepted, escalated_unparsed, escalated_low_confidence, unparsed)",
+    ["stage", "model", "decision"],
+)
+MODEL_CALL_SECONDS = Histogram(
+    "itmo_model_call_seconds", "Latency of LLM calls by stage and model", ["stage", "model"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUESTS = Counter(
+    "itmo_http_requests_total", "Outgoing HTTP requests by upstream and connection (new, reused)",
+    ["upstream", "connection"],
+)
+HTTP_CONNECTIONS_OPENED = Counter(
+    "itmo_http_connections_opened_total", "Connections opened by upstream and kind (tls, plain)", ["upstream", "kind"]
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def record_token_usage(stage: str, usage) -> None:
+    """Count prompt/completion tokens from a Mistral usage object or dict."""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+    for kind in ("prompt", "completion"):
+        value = usage.get(f"{kind}_tokens")
+        if value:
+            LLM_TOKENS.labels(stage, kind).inc(value)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and in-flight requests per API endpoint."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = scope["path"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            REQUEST_SECONDS.labels(endpoint, str(status["code"])).observe(time.perf_counter() - start_time)
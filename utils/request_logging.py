@@ -0,0 +1,146 @@
+import json
+import random
+import time
+from typing import Callable, Dict, Optional
+
+# Fields shortened, longest first, when a record is over record_limit
+_TRUNCATED_FIELDS = ("query", "request_body", "response_body", "error")
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware that writes one structured log record per request.
+
+    Request and response bodies pass through untouched; only the first
+    body_limit bytes of each are kept for the record, and only for requests
+    that will be logged, so streaming responses keep streaming and large
+    bodies are never copied. Requests are sampled per route (longest matching
+    path prefix wins), server errors are always logged, and the serialized
+    record is capped at record_limit characters by shortening its largest
+    fields, so every record stays valid JSON.
+    """
+
+    def __init__(
+        self,
+        app,
+        get_logger: Callable,
+        body_limit: int = 1024,
+        record_limit: int = 4096,
+        sample_rate: float = 1.0,
+        route_sample_rates: Optional[Dict[str, float]] = None,
+    ):
+        self.app = app
+        self.get_logger = get_logger
+        self.body_limit = body_limit
+        self.record_limit = record_limit
+        self.sample_rate = sample_rate
+        # Longest prefixes first so the most specific route matches
+        self.route_sample_rates = sorted(
+            (route_sample_rates or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+
+    def _sample_rate_for(self, path: str) -> float:
+        for prefix, rate in self.route_sample_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = random.random() < self._sample_rate_for(scope["path"])
+        start_time = time.perf_counter()
+        request_body = bytearray()
+        response_body = bytearray()
+        sizes = {"request": 0, "response": 0}
+        response_info = {"status": None, "content_type": "", "capture": False}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                sizes["request"] += len(chunk)
+                if sampled and len(request_body) < self.body_limit:
+                    request_body.extend(chunk[:self.body_limit - len(request_body)])
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response_info["status"] = message["status"]
+                # Server errors are logged whether sampled or not
+                response_info["capture"] = sampled or message["status"] >= 500
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        response_info["content_type"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                sizes["response"] += len(chunk)
+                if response_info["capture"] and len(response_body) < self.body_limit:
+                    response_body.extend(chunk[:self.body_limit - len(response_body)])
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            status = response_info["status"] or 500
+            if sampled or status >= 500:
+                await self._write_record(
+                    scope, status, time.perf_counter() - start_time,
+                    request_body, response_body, sizes, response_info["content_type"], error,
+                )
+
+    async def _write_record(
+        self, scope, status, duration, request_body, response_body, sizes, content_type, error
+    ) -> None:
+        logger = self.get_logger()
+        if logger is None:
+            return
+
+        record = {
+            "event": "request",
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "status": status,
+            "duration_ms": round(duration * 1000, 1),
+            "request_bytes": sizes["request"],
+            "response_bytes": sizes["response"],
+            "content_type": content_type,
+            "request_body": request_body.decode("utf-8", errors="replace"),
+            "response_body": response_body.decode("utf-8", errors="replace"),
+        }
+        if error is not None:
+            record["error"] = repr(error)
+
+        line = json.dumps(record, ensure_ascii=False)
+        if len(line) > self.record_limit:
+            record["truncated"] = True
+            line = self._shorten(record)
+
+        if status >= 500:
+            await logger.error(line)
+        else:
+            await logger.info(line)
+
+    def _shorten(self, record: Dict) -> str:
+        # Cut the field with the longest JSON by the share of it that is over
+        # the limit (escapes make JSON longer than the text), until it fits
+        while True:
+            line = json.dumps(record, ensure_ascii=False)
+            excess = len(line) - self.record_limit
+            sizes = {
+                name: len(json.dumps(record[name], ensure_ascii=False))
+                for name in _TRUNCATED_FIELDS if record.get(name)
+            }
+            if excess <= 0 or not sizes:
+                return line
+            longest = max(sizes, key=sizes.get)
+            value = record[longest]
+            keep = len(value) * max(sizes[longest] - excess, 0) // sizes[longest]
+            record[longest] = value[:min(keep, len(value) - 1)]
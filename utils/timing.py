@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.metrics import STAGE_SECONDS
+from utils.tracing import span
+
+_current_timings: ContextVar[Optional["StageTimings"]] = ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """Wall-clock durations of the pipeline stages run for one request."""
+
+    def __init__(self):
+        self.records: List[Tuple[str, float]] = []
+
+    def add(self, name: str, duration: float) -> None:
+        self.records.append((name, duration))
+
+    def totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for name, duration in self.records:
+            totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def server_timing_header(self) -> str:
+        # Durations in milliseconds, as the Server-Timing header expects
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}" for name, duration in self.totals().items()
+        )
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Record how long the enclosed block takes as a stage of the current request,
+    and as a span when the request is traced.
+    """
+    timings = _current_timings.get()
+    start_time = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        duration = time.perf_counter() - start_time
+        STAGE_SECONDS.labels(name).observe(duration)
+        if timings is not None:
+            timings.add(name, duration)
+
+
+class StageTimingMiddleware:
+    """ASGI middleware that collects stage timings and reports them in a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        token = _current_timings.set(timings)
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start" and timings.records:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing_header().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            # Time outside this span is spent in the outer middlewares
+            with span("app"):
+                await self.app(scope, receive, send_with_timings)
+        finally:
+            _current_timings.reset(token)
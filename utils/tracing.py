@@ -0,0 +1,291 @@
+"""
+Opt-in per-request traces.
+
+A traced request records a tree of spans (middleware, validation, searches,
+LLM calls, agent steps, JSON parsing) and, on demand, a sampling CPU profile
+of the worker. Traces are written as gzipped JSON to a directory shared by
+all workers and served by the admin endpoints in main.py. Requests that are
+not traced pay one context variable lookup per span.
+"""
+import asyncio
+import gzip
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Span:
+    """One timed operation of a traced request."""
+
+    __slots__ = ("name", "start", "end", "attrs", "children")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs or {}
+        self.children: List["Span"] = []
+
+    def finish(self, **attrs) -> None:
+        self.attrs.update(attrs)
+        self.end = time.perf_counter()
+
+    def to_dict(self, origin: float) -> Dict:
+        # Offsets and durations in milliseconds from the start of the request
+        end = self.end if self.end is not None else time.perf_counter()
+        data = {
+            "n": self.name,
+            "s": round((self.start - origin) * 1000, 2),
+            "d": round((end - self.start) * 1000, 2),
+        }
+        if self.attrs:
+            data["a"] = self.attrs
+        if self.children:
+            data["c"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+def start_span(name: str, **attrs) -> Optional[Span]:
+    """
+    Open a child of the current span without making it current.
+
+    For operations that start and end in different callbacks; the caller
+    finishes the span. Returns None when the request is not traced.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    child = Span(name, attrs)
+    parent.children.append(child)
+    return child
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Optional[Span]]:
+    """Record the enclosed block as a span of the current trace, if there is one."""
+    child = start_span(name, **attrs)
+    if child is None:
+        yield None
+        return
+
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+class SamplingProfiler:
+    """
+    Statistical CPU profiler: a thread that periodically samples the stacks of
+    all other threads with sys._current_frames.
+
+    It samples the whole worker, so concurrent requests show up in the profile
+    as well. Only one profiler runs per process at a time.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._lock.release()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                # Collapsed stack format, outermost frame first
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def to_dict(self, top: int = 200) -> Dict:
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stacks": dict(self.stacks.most_common(top)),
+        }
+
+
+class Trace:
+    """Span tree and optional profile of one request."""
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.root = Span(name, attrs)
+        self.profiler: Optional[SamplingProfiler] = None
+
+    def to_dict(self) -> Dict:
+        data = {"id": self.id, "started_at": self.started_at, "root": self.root.to_dict(self.root.start)}
+        if self.profiler is not None:
+            data["profile"] = self.profiler.to_dict()
+        return data
+
+
+class TraceStore:
+    """Gzipped JSON trace files in one directory, keeping the newest max_files."""
+
+    def __init__(self, directory: str, max_files: int = 200):
+        self.directory = directory
+        self.max_files = max_files
+
+    @staticmethod
+    def valid_id(trace_id: str) -> bool:
+        return len(trace_id) == 32 and all(c in "0123456789abcdef" for c in trace_id)
+
+    def path_for(self, trace_id: str) -> str:
+        return os.path.join(self.directory, f"{trace_id}.json.gz")
+
+    def save(self, trace: Trace) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(trace.id)
+        data = json.dumps(trace.to_dict(), ensure_ascii=False, separators=(",", ":"), default=str)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._prune()
+        return path
+
+    def list(self) -> List[Dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json.gz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                continue
+            entries.append({"id": filename[:-len(".json.gz")], "created": stat.st_mtime, "size": stat.st_size})
+        return sorted(entries, key=lambda entry: entry["created"], reverse=True)
+
+    def _prune(self) -> None:
+        for entry in self.list()[self.max_files:]:
+            try:
+                os.remove(self.path_for(entry["id"]))
+            except FileNotFoundError:
+                pass
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces a request when it carries the debug header with
+    the admin token, or when it is picked by sample_rate.
+
+    "X-Debug-Profile: 1" on a header-traced request (or profile_sampled for
+    sampled ones) also records a CPU profile. The trace id is returned in the
+    X-Trace-Id response header.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: TraceStore,
+        token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        profile_sampled: bool = False,
+        profile_interval: float = 0.005,
+    ):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.profile_sampled = profile_sampled
+        self.profile_interval = profile_interval
+
+    def _decide(self, scope) -> Optional[bool]:
+        """None when the request is not traced, otherwise whether to profile it."""
+        headers = dict(scope.get("headers", []))
+        debug = headers.get(b"x-debug-trace")
+        if debug is not None and self.token and hmac.compare_digest(debug, self.token.encode("latin-1")):
+            return headers.get(b"x-debug-profile") == b"1"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.profile_sampled
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = self._decide(scope)
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace("request", {"method": scope["method"], "path": scope["path"]})
+        if profile:
+            profiler = SamplingProfiler(self.profile_interval)
+            if profiler.start():
+                trace.profiler = profiler
+            else:
+                trace.root.attrs["profile_skipped"] = "another profile is running"
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.attrs["status"] = message["status"]
+                trace.root.attrs["ttfb_ms"] = round((time.perf_counter() - trace.root.start) * 1000, 2)
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current_span.set(trace.root)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_span.reset(token)
+            trace.root.finish()
+            if trace.profiler is not None:
+                trace.profiler.stop()
+            # The response is complete by now, so writing the file does not delay it
+            try:
+                await asyncio.to_thread(self.store.save, trace)
+            except Exception:
+                logger.exception("Failed to save trace %s", trace.id)